@@ -0,0 +1,67 @@
+"""
+Latency and peak memory of CVMNsegm with and without its inference mode.
+
+    python -m benchmarks.inference --backbone resnet50 --num_frames 36 --height 300 --width 540
+"""
+import argparse
+import time
+
+import torch
+
+import util.misc as utils
+from main import get_args_parser as get_model_args_parser
+from models import build_model
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser('inference mode benchmark', add_help=False,
+                                     parents=[get_model_args_parser()])
+    parser.add_argument('--height', default=300, type=int)
+    parser.add_argument('--width', default=540, type=int)
+    parser.add_argument('--num_words', default=10, type=int)
+    parser.add_argument('--iters', default=20, type=int)
+    return parser
+
+
+def run(model, samples, expressions, inference, iters):
+    """Returns the mean latency in ms and, on CUDA, the peak memory allocated in MiB."""
+    device = samples.tensors.device
+    model(samples, expressions, inference=inference)  # warm up
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        model(samples, expressions, inference=inference)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    latency = (time.perf_counter() - start) / iters * 1000
+    peak = torch.cuda.max_memory_allocated(device) / 2 ** 20 if device.type == 'cuda' else float('nan')
+    return latency, peak
+
+
+@torch.no_grad()
+def main(args):
+    args.masks = True
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    model, _, _ = build_model(args)
+    model.to(device)
+    model.eval()
+
+    frames = torch.randn(args.num_frames, 3, args.height, args.width, device=device)
+    samples = utils.nested_tensor_from_tensor_list(list(frames))
+    expressions = torch.randn(1, args.num_words, 768, device=device)
+
+    print('{} frames of {}x{} on {}'.format(args.num_frames, args.width, args.height, device))
+    baseline = None
+    for name, inference in (('full outputs', False), ('inference mode', True)):
+        latency, peak = run(model, samples, expressions, inference, args.iters)
+        baseline = baseline or (latency, peak)
+        print('{:<16} {:9.1f} ms  {:5.2f}x  {:9.1f} MiB peak  {:+9.1f} MiB'.format(
+            name, latency, baseline[0] / latency, peak, peak - baseline[1]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('inference mode benchmark', parents=[get_args_parser()])
+    main(parser.parse_args())
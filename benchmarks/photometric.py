@@ -0,0 +1,52 @@
+"""
+Throughput of the per-frame PhotometricDistort against ClipPhotometricDistort.
+
+    python -m benchmarks.photometric --num_frames 36 --height 300 --width 540
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+import datasets.transforms as T
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser('photometric augmentation benchmark', add_help=False)
+    parser.add_argument('--num_frames', default=36, type=int)
+    parser.add_argument('--height', default=300, type=int)
+    parser.add_argument('--width', default=540, type=int)
+    parser.add_argument('--iters', default=20, type=int)
+    parser.add_argument('--seed', default=42, type=int)
+    return parser
+
+
+def clips_per_second(transform, clip, iters):
+    transform(clip, None)  # warm up
+    start = time.perf_counter()
+    for _ in range(iters):
+        transform(clip, None)
+    return iters / (time.perf_counter() - start)
+
+
+def main(args):
+    np.random.seed(args.seed)
+    clip = [Image.fromarray(np.random.randint(0, 256, (args.height, args.width, 3), dtype=np.uint8))
+            for _ in range(args.num_frames)]
+    transforms = [
+        ('PhotometricDistort', T.PhotometricDistort()),
+        ('ClipPhotometricDistort(per_frame=True)', T.ClipPhotometricDistort(per_frame=True)),
+        ('ClipPhotometricDistort(per_frame=False)', T.ClipPhotometricDistort(per_frame=False)),
+    ]
+    print('{} frames of {}x{}'.format(args.num_frames, args.width, args.height))
+    baseline = None
+    for name, transform in transforms:
+        speed = clips_per_second(transform, clip, args.iters)
+        baseline = baseline or speed
+        print('{:<42} {:8.2f} clips/s  {:5.2f}x'.format(name, speed, speed / baseline))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('photometric augmentation benchmark', parents=[get_args_parser()])
+    main(parser.parse_args())
@@ -17,28 +17,38 @@ from torch.utils.data import Dataset, DataLoader
 from torchvision.transforms import transforms
 import torchvision.transforms.functional as F
 
-from .utils import resize_and_pad, resize
+from .feature_store import ClipFeatureStore, FeatureStore, clip_frame_key
+from .frame_cache import SharedFrameCache
+from .frame_store import FrameStore
+from .gt_store import A2DGroundTruthStore
+from .manifest import load_manifest
+from .utils import clip_view, resize_and_pad, resize, sample_negative_queries, string_array
 import datasets.transforms as T
 import clip
 
 
 class A2DSubset(Dataset):
     def __init__(self, image_set, args, num_frames):
-        self.word2vec = KeyedVectors.load_word2vec_format(args['vocab_path'], binary=True)
         self.args = args
         self.col_path = os.path.join(args['annotation_path'], 'col')  # rgb
         self.mat_path = os.path.join(args['annotation_path'], 'mat')  # matrix
         self.max_num_words = args['max_num_words']
 
-        self.bert_embedding = BertEmbedding()
-        self.clip_preprocess = clip.load("RN50")[1]
-        self._read_video_info()
-        self._read_dataset_samples()
-        
+        self.bert_store = FeatureStore(args['bert_store']) if args.get('bert_store') else None
+        self._bert_embedding = None
+        self.clip_store = ClipFeatureStore(args['clip_store']) if args.get('clip_store') else None
+        self.frame_cache = args.get('frame_cache')
+        self.tensor_transforms = args.get('tensor_transforms', False)
+        # 'full', or 'frames' to return only the frames and their CLIP view
+        self.sample_mode = args.get('sample_mode', 'full')
+        self.frame_store = FrameStore(args['frame_store']) if args.get('frame_store') else None
+        self.gt_store = A2DGroundTruthStore(args['gt_store']) if args.get('gt_store') else None
+        self._load_manifest()
+
         self.num_frames = num_frames
         self.videos = self.train_videos
         self.samples = self.train_samples
-        self._transforms = make_coco_transforms(image_set)
+        self._transforms = make_coco_transforms(image_set, args.get('uint8_transport', False))
 
         self.is_full = np.zeros(len(self.samples), dtype=np.int64)
         np.random.seed(88)
@@ -47,29 +57,47 @@ class A2DSubset(Dataset):
         self.full_videos = self.full_videos[:int(0.5 * len(self.full_videos))]
         # self.train = train
 
-        self.extract_query = {}
-        for i in range(len(self.train_samples)):
-            numbers = random.sample(range(0, len(self.train_query)), 10)
-            self.extract_query[i] = numbers
-
+        self.extract_query = sample_negative_queries(len(self.train_samples), len(self.train_query), 10)
 
     def __len__(self):
         return len(self.samples)
 
+    def sample_videos(self):
+        """The video of every sample, for datasets.samplers.VideoAffinitySampler."""
+        return self.samples['video_id']
+
+    @property
+    def bert_embedding(self):
+        # created on first use, so in each loader worker, and never when a BERT store is given
+        if self._bert_embedding is None:
+            self._bert_embedding = BertEmbedding()
+        return self._bert_embedding
+
+    def sample_sizes(self):
+        """The (width, height) of the video of every sample, for datasets.samplers.ShapeBucketSampler."""
+        return np.asarray([self.videos[v.decode()]['size'][::-1] for v in self.samples['video_id']])
+
     def __getitem__(self, index):
-        video_id, instance_id, frame_idx, query = self.samples[index]
-        query = query.lower()
-        frame_idx = int(frame_idx)
-        
-        h5_path = os.path.join('data/a2d/a2d_annotation_with_instances', video_id,
-                               '%05d.h5' % (frame_idx + 1))
-        if not os.path.exists(h5_path):
-            h5_path = os.path.join('data/a2d/a2d_annotation_with_instances', video_id,
-                                   '%05d.h5' % (24 + 1))
+        plan = None
+        if isinstance(index, tuple):
+            # (index, resample plan) from datasets.samplers.ShapeBucketSampler
+            index, plan = index
+        sample = self.samples[index]
+        video_id = sample['video_id'].decode()
+        instance_id = int(sample['instance_id'])
+        frame_idx = int(sample['frame_idx'])
+        query = sample['query'].decode().lower()
+        if plan is not None:
+            height, width = self.videos[video_id]['size']
+            self._transforms.use_plan((width, height), plan)
+
         frame_path = os.path.join('data/a2d/Release/pngs320H', video_id)
 
-        frames = list(map(lambda x: os.path.join(frame_path, x),
-                          sorted(os.listdir(frame_path))))
+        if self.frame_store is not None:
+            frames = [os.path.join(frame_path, x) for x in self.frame_store.names(video_id)]
+        else:
+            frames = list(map(lambda x: os.path.join(frame_path, x),
+                              sorted(os.listdir(frame_path))))
         # print(len(frames), self.videos['num_frames'])
 
         assert len(frames) == self.videos[video_id]['num_frames']
@@ -84,14 +112,33 @@ class A2DSubset(Dataset):
                 all_frames[i] = 0
             elif all_frames[i] >= len(frames):
                 all_frames[i] = len(frames) - 1
+        frame_ids = all_frames
         all_frames = np.asarray(frames)[all_frames]
 
         img = []
-        for i in all_frames:
-            img.append(Image.open(i).convert('RGB'))
-
-        img_clip = torch.stack([self.clip_preprocess(im) for im in img])
+        clip_frames = None
+        if self.frame_store is not None:
+            frames = self.frame_store.frames(video_id, frame_ids)
+            if self.tensor_transforms:
+                # the frames gathered out of the memory map are the clip of the tensor transforms
+                clip_frames = T.stack_clip(frames)
+            else:
+                img = [Image.fromarray(frame) for frame in frames]
+        else:
+            for i in all_frames:
+                img.append(self._load_frame(video_id, i))
+        if self.tensor_transforms and clip_frames is None:
+            clip_frames = T.stack_clip(img)
+
+        if self.clip_store is not None:
+            img_clip = torch.from_numpy(self.clip_store.encode_image([clip_frame_key('a2d', f) for f in all_frames]))
+        else:
+            img_clip = clip_view(clip_frames if clip_frames is not None else img)
         # img_clip, text_clip = None, None
+        if self.sample_mode == 'frames':
+            # the target domain only feeds its frames and their CLIP view to the adaptation losses
+            img, _ = self._apply_transforms(img, None, clip_frames)
+            return img, None, None, (img_clip, None)
 
         expressions = []
         # expressions.append(np.zeros((7, 768)))
@@ -99,13 +146,59 @@ class A2DSubset(Dataset):
         expressions.append(query)
         numbers = self.extract_query[index]
         for i in range(10):
-            query = self.train_query[numbers[i]]
+            query = self.train_query[numbers[i]].decode()
             expressions.append(query)
-        text_clip = clip.tokenize(expressions)
-        results = self.bert_embedding(expressions)
-        expressions = [np.asarray(result[1]) for result in results]
+        if self.clip_store is not None:
+            text_clip = torch.from_numpy(self.clip_store.encode_text(expressions))
+        else:
+            text_clip = clip.tokenize(expressions)
+        if self.bert_store is not None:
+            expressions = [self.bert_store[exp] for exp in expressions]
+        else:
+            results = self.bert_embedding(expressions)
+            expressions = [np.asarray(result[1]) for result in results]
 
         # fine-grained mask
+        if self.gt_store is not None:
+            gt_frame = frame_idx if self.gt_store.has_frame(video_id, frame_idx) else 24
+            fine_gt_mask, coarse_gt_box, class_id, area = self.gt_store.get(video_id, gt_frame, instance_id)
+        else:
+            fine_gt_mask, coarse_gt_box, class_id, area = self._read_h5_gt(video_id, frame_idx, instance_id)
+        image_size = T.get_clip_size(clip_frames if clip_frames is not None else img)
+        w, h = image_size
+        if self.frame_store is not None:
+            # the ground truth is annotated at the size of the unpacked frames
+            w, h = self.frame_store.orig_size(video_id)
+        target = {}
+        target['boxes'] = torch.from_numpy(coarse_gt_box).float().unsqueeze(0)
+        target['labels'] = torch.from_numpy(np.array([class_id]))
+        target['masks'] = torch.from_numpy(fine_gt_mask).unsqueeze(0)
+        target['image_id'] = torch.tensor([index])
+        target['valid'] = torch.tensor([1])
+        target['area'] = torch.tensor([int(area)])
+        target['iscrowd'] = torch.tensor([0])
+        target["orig_size"] = torch.as_tensor([int(h), int(w)])
+        target["size"] = torch.as_tensor([int(h), int(w)])
+        if image_size != (w, h):
+            target = T.resize_target(target, (w, h), image_size)
+
+        img, target = self._apply_transforms(img, target, clip_frames)
+        return img, expressions, target, (img_clip, text_clip)
+
+    def _apply_transforms(self, img, target, clip_frames=None):
+        if self.tensor_transforms:
+            img = clip_frames if clip_frames is not None else T.stack_clip(img)
+        if self._transforms is not None:
+            img, target = self._transforms(img, target)
+        img = img.flatten(0, 1) if isinstance(img, torch.Tensor) else torch.cat(img, dim=0)
+        return img, target
+
+    def _read_h5_gt(self, video_id, frame_idx, instance_id):
+        h5_path = os.path.join('data/a2d/a2d_annotation_with_instances', video_id,
+                               '%05d.h5' % (frame_idx + 1))
+        if not os.path.exists(h5_path):
+            h5_path = os.path.join('data/a2d/a2d_annotation_with_instances', video_id,
+                                   '%05d.h5' % (24 + 1))
         with h5py.File(h5_path, mode='r') as fp:
             instance = np.asarray(fp['instance'])
             all_masks = np.asarray(fp['reMask'])
@@ -130,34 +223,38 @@ class A2DSubset(Dataset):
                 class_id = int(all_ids[0][idx])
                 mask = mask[np.newaxis]
 
-            #
-            # print(class_id, class_name)
-
             assert len(mask.shape) == 3
             assert mask.shape[0] > 0
 
             fine_gt_mask = np.transpose(np.asarray(mask), (0, 2, 1))[0]
-
-        pos = np.where(fine_gt_mask==1)
-        x1, y1, x2, y2 = np.min(pos[0]), np.min(pos[1]), np.max(pos[0]), np.max(pos[1])
-        coarse_gt_box1 = np.array([y1, x1, y2, x2])
         area = np.sum(fine_gt_mask)
-        w, h = img[0].size
-        target = {}
-        target['boxes'] = torch.from_numpy(coarse_gt_box).float().unsqueeze(0)
-        target['labels'] = torch.from_numpy(np.array([class_id]))
-        target['masks'] = torch.from_numpy(fine_gt_mask).unsqueeze(0)
-        target['image_id'] = torch.tensor([index])
-        target['valid'] = torch.tensor([1])
-        target['area'] = torch.tensor([int(area)])
-        target['iscrowd'] = torch.tensor([0])
-        target["orig_size"] = torch.as_tensor([int(h), int(w)])
-        target["size"] = torch.as_tensor([int(h), int(w)])
-
-        if self._transforms is not None:
-            img, target = self._transforms(img, target)
-
-        return torch.cat(img,dim=0), expressions, target, (img_clip, text_clip)         
+        return fine_gt_mask, coarse_gt_box, class_id, area
+
+    def _load_frame(self, video_id, path):
+        if self.frame_cache is None:
+            return Image.open(path).convert('RGB')
+        return self.frame_cache.load(video_id + '/' + os.path.basename(path), path)
+
+    def _load_manifest(self):
+        # the frame counts come from listing every video's folder, whose mtime changes with its files,
+        # unlike that of col_path
+        video_dirs = sorted(os.path.join(self.col_path, v) for v in os.listdir(self.col_path))
+        sources = [self.args['videoset_path'], self.args['sample_path'], self.col_path] + video_dirs
+        manifest = load_manifest(self.args.get('manifest_cache_dir'), 'a2d', sources, self._build_manifest)
+        self.train_videos, self.test_videos = manifest['train_videos'], manifest['test_videos']
+        self.train_samples, self.test_samples = manifest['train_samples'], manifest['test_samples']
+        self.train_query = manifest['train_query']
+
+    def _build_manifest(self):
+        self._read_video_info()
+        self._read_dataset_samples()
+        return {
+            'train_videos': self.train_videos,
+            'test_videos': self.test_videos,
+            'train_samples': sample_array(self.train_samples),
+            'test_samples': sample_array(self.test_samples),
+            'train_query': string_array(self.train_query),
+        }
 
     def _read_video_info(self):
         self.train_videos, self.test_videos = {}, {}
@@ -222,6 +319,19 @@ class A2DSubset(Dataset):
         # exit(0)
 
 
+def sample_array(samples):
+    """Packs [video_id, instance_id, frame_idx, query] rows into one structured array."""
+    video_ids = string_array([sample[0] for sample in samples])
+    queries = string_array([sample[3] for sample in samples])
+    array = np.zeros(len(samples), dtype=[('video_id', video_ids.dtype), ('instance_id', np.int32),
+                                          ('frame_idx', np.int32), ('query', queries.dtype)])
+    array['video_id'] = video_ids
+    array['instance_id'] = [int(sample[1]) for sample in samples]
+    array['frame_idx'] = [int(sample[2]) for sample in samples]
+    array['query'] = queries
+    return array
+
+
 class A2DSlicRGB:
     def __init__(self, image_set, args):
         self.word2vec = KeyedVectors.load_word2vec_format(args['vocab_path'], binary=True)
@@ -323,27 +433,29 @@ class A2DSlicRGB:
         return self.test_set_
 
 
-def make_coco_transforms(image_set):
+def make_coco_transforms(image_set, uint8_transport=False):
 
-    normalize = T.Compose([
-        T.ToTensor(),
-        T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
+    if uint8_transport:
+        # normalized in the main process, see util.misc.normalize_nested_tensor
+        normalize = T.ToUint8Tensor()
+    else:
+        normalize = T.Compose([
+            T.ToTensor(),
+            T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
 
     scales = [480, 512, 544, 576, 608, 640, 672, 704, 736, 768]
 
     if image_set == 'train':
         return T.Compose([
             T.RandomHorizontalFlip(),
-            T.RandomResize(scales, max_size=800),
-            T.PhotometricDistort(),
-            T.Compose([
-                     T.RandomResize([400, 500, 600]),
-                     T.RandomSizeCrop(384, 600),
-                     # To suit the GPU memory the scale might be different
-                     T.RandomResize([300], max_size=540),#for r50
-                     #T.RandomResize([280], max_size=504),#for r101
-            ]),
+            # RandomResize(scales, max_size=800) -> RandomResize([400, 500, 600]) ->
+            # RandomSizeCrop(384, 600) -> RandomResize([300], max_size=540), resampled once
+            T.FusedRandomResizeCrop(scales, max_size=800, crop_scales=[400, 500, 600], crop_size=(384, 600),
+                                    # To suit the GPU memory the scale might be different
+                                    final_scales=[300], final_max_size=540),#for r50
+                                    #final_scales=[280], final_max_size=504),#for r101
+            T.ClipPhotometricDistort(per_frame=True),
             normalize,
         ])
 
@@ -361,7 +473,18 @@ def build(image_set, args):
         "videoset_path": "data/a2d/Release/videoset.csv",
         "annotation_path": "data/a2d/Release/Annotations",
         "sample_path": "data/a2d/a2d_annotation_info.txt",
+        "bert_store": args.bert_store,
+        "clip_store": args.clip_store,
+        "frame_store": args.a2d_frame_store,
+        "gt_store": args.a2d_gt_store,
+        "manifest_cache_dir": args.manifest_cache_dir,
+        "tensor_transforms": args.tensor_transforms,
+        "uint8_transport": args.uint8_transport,
+        "sample_mode": getattr(args, 'sample_mode', 'full'),
     }
+    if args.frame_cache_mb > 0:
+        # pngs320H frames are 320 pixels high
+        paths["frame_cache"] = SharedFrameCache(args.frame_cache_mb * 2 ** 20, slot_bytes=320 * 640 * 3)
     dataset = A2DSubset(image_set, paths, num_frames = args.num_frames)
     return dataset
 
@@ -0,0 +1,145 @@
+"""
+Prefetching wrapper that hands out batches already on the device.
+"""
+import queue
+import threading
+
+import torch
+
+from util.misc import NestedTensor, normalize_nested_tensor
+
+
+def map_tensors(fn, obj):
+    """Applies fn to every tensor and NestedTensor in nested tuples, lists and dicts."""
+    if isinstance(obj, (torch.Tensor, NestedTensor)):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return {k: map_tensors(fn, v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(map_tensors(fn, v) for v in obj)
+    return obj
+
+
+def pin_memory(batch):
+    return map_tensors(lambda t: t if t.is_pinned() else t.pin_memory(), batch)
+
+
+def to_device(batch, device, non_blocking=False):
+    return map_tensors(lambda t: t.to(device, non_blocking=non_blocking), batch)
+
+
+def record_stream(batch, stream):
+    def record(t):
+        for tensor in (t.decompose() if isinstance(t, NestedTensor) else (t,)):
+            if tensor is not None and tensor.is_cuda:
+                tensor.record_stream(stream)
+        return t
+    map_tensors(record, batch)
+
+
+def normalize_uint8_samples(batch):
+    """Normalizes the uint8 image batches of --uint8_transport (see util.misc.normalize_nested_tensor)."""
+    return map_tensors(lambda t: normalize_nested_tensor(t)
+                       if isinstance(t, NestedTensor) and t.tensors.dtype == torch.uint8 else t, batch)
+
+
+class _Error(object):
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_END = object()
+
+
+class DataPrefetcher(object):
+    """Iterates over loader with every batch already moved to device.
+
+    A background thread keeps up to depth batches ready ahead of the consumer. On
+    CUDA it pins them and issues non-blocking copies on a side stream, so the
+    copies of step N+1 overlap the compute of step N; on CPU the lookahead still
+    overlaps loading, collation and prepare with the step. prepare, if given, is
+    applied to every batch once it is on the device.
+
+    The host tensors of a batch may be reused by a later collate (util.misc.Collator
+    in the main process): on CUDA the producer waits for the copies of a batch
+    before fetching the next one, on CPU the batches handed out are those tensors
+    themselves, so the collator needs at least depth + 3 slots.
+    """
+
+    def __init__(self, loader, device, prepare=None, depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        if self.device.type == 'cuda' and self.device.index is None:
+            # the current device is set per thread, resolve it on the caller's, as the rank's GPU
+            self.device = torch.device('cuda', torch.cuda.current_device())
+        self.prepare = prepare
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _produce(self, ready, stop):
+        stream = None
+        if self.device.type == 'cuda':
+            torch.cuda.set_device(self.device)
+            stream = torch.cuda.Stream(self.device)
+        copied = None
+        try:
+            for batch in self.loader:
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = to_device(pin_memory(batch), self.device, non_blocking=True)
+                        copied = torch.cuda.Event()
+                        copied.record(stream)
+                        if self.prepare is not None:
+                            batch = self.prepare(batch)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = to_device(batch, self.device)
+                    if self.prepare is not None:
+                        batch = self.prepare(batch)
+                ready.put((batch, event))
+                if stop.is_set():
+                    return
+                if copied is not None:
+                    # the next collate may refill the host buffers the copies read from
+                    copied.synchronize()
+            ready.put(_END)
+        except Exception as e:
+            ready.put(_Error(e))
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for batch in self.loader:
+                batch = to_device(batch, self.device)
+                yield self.prepare(batch) if self.prepare is not None else batch
+            return
+
+        ready = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(ready, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Error):
+                    raise item.exc
+                batch, event = item
+                if event is not None:
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    # the tensors were allocated on the side stream but are used on the current one
+                    record_stream(batch, current)
+                yield batch
+        finally:
+            # unblock the producer if the consumer stopped early
+            stop.set()
+            while thread.is_alive():
+                try:
+                    ready.get(timeout=0.1)
+                except queue.Empty:
+                    pass
@@ -0,0 +1,164 @@
+"""
+Memory-mapped stores for precomputed features (BERT tokens, CLIP embeddings).
+
+A store is a directory holding one ragged float matrix:
+    features.bin  - all rows back to back, [total_rows x dim]
+    offsets.npy   - int64 [num_keys + 1], rows of key i are offsets[i]:offsets[i+1]
+    index.json    - {"keys": [...], "dim": d, "dtype": "float32", "meta": {...}}
+"""
+import json
+import os
+
+import numpy as np
+
+
+class FeatureStore(object):
+    """Read-only view of a feature store.
+
+    The memory map is opened lazily, so a store built in the main process can be
+    handed to DataLoader workers and every worker maps the file itself.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        with open(os.path.join(self.root, 'index.json')) as f:
+            index = json.load(f)
+        self.keys = index['keys']
+        self.dim = index['dim']
+        self.dtype = np.dtype(index['dtype'])
+        self.meta = index.get('meta', {})
+        self.key2id = {k: i for i, k in enumerate(self.keys)}
+        self.offsets = np.load(os.path.join(self.root, 'offsets.npy'))
+        self._data = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.key2id
+
+    def __getitem__(self, key):
+        return self.get_by_id(self.index(key))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    @property
+    def data(self):
+        if self._data is None:
+            num_rows = int(self.offsets[-1])
+            self._data = np.memmap(os.path.join(self.root, 'features.bin'), dtype=self.dtype,
+                                   mode='r', shape=(num_rows, self.dim))
+        return self._data
+
+    def index(self, key):
+        try:
+            return self.key2id[key]
+        except KeyError:
+            raise KeyError('{!r} is not in the feature store {}, rebuild it with prepare_data.py'.format(
+                key, self.root))
+
+    def get_by_id(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return np.array(self.data[start:end])
+
+
+class FeatureStoreWriter(object):
+    def __init__(self, root, dim, dtype='float32', meta=None):
+        self.root = str(root)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.meta = meta or {}
+        self.keys = []
+        self.offsets = [0]
+        os.makedirs(self.root, exist_ok=True)
+        self._fp = open(os.path.join(self.root, 'features.bin'), 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, key, features):
+        features = np.asarray(features, dtype=self.dtype).reshape(-1, self.dim)
+        self._fp.write(np.ascontiguousarray(features).tobytes())
+        self.keys.append(key)
+        self.offsets.append(self.offsets[-1] + features.shape[0])
+
+    def close(self):
+        if self._fp is None:
+            return
+        self._fp.close()
+        self._fp = None
+        np.save(os.path.join(self.root, 'offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+        with open(os.path.join(self.root, 'index.json'), 'w') as f:
+            json.dump({'keys': self.keys, 'dim': self.dim, 'dtype': self.dtype.name, 'meta': self.meta}, f)
+
+
+def build_bert_store(expressions, root, batch_size=256):
+    """Embeds every unique expression once with BERT and writes its token features."""
+    from bert_embedding import BertEmbedding
+
+    bert_embedding = BertEmbedding()
+    expressions = sorted(set(expressions))
+    with FeatureStoreWriter(root, dim=768, meta={'model': 'bert_12_768_12'}) as writer:
+        for i in range(0, len(expressions), batch_size):
+            chunk = expressions[i:i + batch_size]
+            for exp, result in zip(chunk, bert_embedding(chunk)):
+                writer.add(exp, np.asarray(result[1]))
+            print('bert store: {}/{}'.format(min(i + batch_size, len(expressions)), len(expressions)))
+
+
+class ClipFeatureStore(object):
+    """Frozen CLIP embeddings: one row per video frame and one row per expression.
+
+    Frames are keyed by '<dataset>/<video>/<file name>', see clip_frame_key.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.image = FeatureStore(os.path.join(self.root, 'image'))
+        self.text = FeatureStore(os.path.join(self.root, 'text'))
+
+    def encode_image(self, keys):
+        return np.concatenate([self.image[k] for k in keys], axis=0)
+
+    def encode_text(self, expressions):
+        return np.concatenate([self.text[e] for e in expressions], axis=0)
+
+
+def clip_frame_key(dataset, frame_path):
+    video, name = os.path.split(os.path.normpath(frame_path))
+    return '/'.join([dataset, os.path.basename(video), name])
+
+
+def build_clip_store(frames, expressions, root, model='RN50', device='cuda', batch_size=256):
+    """Encodes frames [(key, path), ...] and expressions with the frozen CLIP model."""
+    import clip
+    import torch
+    from PIL import Image
+
+    selector, preprocess = clip.load(model, device=device)
+    dim = selector.visual.output_dim
+    meta = {'model': model, 'logit_scale': float(selector.logit_scale.exp())}
+
+    with torch.no_grad(), FeatureStoreWriter(os.path.join(root, 'image'), dim=dim, meta=meta) as writer:
+        for i in range(0, len(frames), batch_size):
+            chunk = frames[i:i + batch_size]
+            images = torch.stack([preprocess(Image.open(path).convert('RGB')) for _, path in chunk]).to(device)
+            features = selector.encode_image(images).float().cpu().numpy()
+            for (key, _), feature in zip(chunk, features):
+                writer.add(key, feature)
+            print('clip image store: {}/{}'.format(min(i + batch_size, len(frames)), len(frames)))
+
+    expressions = sorted(set(expressions))
+    with torch.no_grad(), FeatureStoreWriter(os.path.join(root, 'text'), dim=dim, meta=meta) as writer:
+        for i in range(0, len(expressions), batch_size):
+            chunk = expressions[i:i + batch_size]
+            features = selector.encode_text(clip.tokenize(chunk).to(device)).float().cpu().numpy()
+            for exp, feature in zip(chunk, features):
+                writer.add(exp, feature)
+        print('clip text store: {} expressions'.format(len(expressions)))
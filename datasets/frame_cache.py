@@ -0,0 +1,128 @@
+"""
+Decoded frame cache shared by all DataLoader workers of one job.
+"""
+import hashlib
+import multiprocessing as mp
+
+import numpy as np
+from PIL import Image
+
+
+def jpeg_reduction(scale, max_reduction=8):
+    """Largest power of two, up to max_reduction, that is at most scale."""
+    reduction = 1
+    while reduction * 2 <= min(scale, max_reduction):
+        reduction *= 2
+    return reduction
+
+
+def decode_frame(path, reduction=1):
+    """Decodes an RGB frame, for JPEGs directly at 1/reduction of its size in the DCT domain."""
+    im = Image.open(path)
+    if reduction > 1:
+        im.draft('RGB', (im.width // reduction, im.height // reduction))
+    return im.convert('RGB')
+
+
+def frame_hash(key):
+    h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little', signed=True)
+    # 0 marks an empty slot
+    return h or 1
+
+
+class SharedFrameCache(object):
+    """LRU cache of decoded uint8 frames, keyed by '<video>/<frame>'.
+
+    All state lives in shared memory, so the cache must be created in the main
+    process before the DataLoader starts its workers, which then inherit it.
+    The byte budget is split into slots of slot_bytes; frames that do not fit
+    into one slot bypass the cache.
+    """
+
+    def __init__(self, budget_bytes, slot_bytes=720 * 1280 * 3):
+        self.slot_bytes = int(slot_bytes)
+        self.num_slots = max(1, int(budget_bytes) // self.slot_bytes)
+        self._lock = mp.Lock()
+        self._pool = mp.RawArray('B', self.num_slots * self.slot_bytes)
+        self._keys = mp.RawArray('q', self.num_slots)
+        self._shapes = mp.RawArray('i', self.num_slots * 3)
+        self._clock = mp.RawArray('q', self.num_slots)
+        # hits, misses, bypassed, global clock
+        self._counters = mp.RawArray('q', 4)
+        self._arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def _views(self):
+        if self._arrays is None:
+            self._arrays = (
+                np.frombuffer(self._pool, dtype=np.uint8).reshape(self.num_slots, self.slot_bytes),
+                np.frombuffer(self._keys, dtype=np.int64),
+                np.frombuffer(self._shapes, dtype=np.int32).reshape(self.num_slots, 3),
+                np.frombuffer(self._clock, dtype=np.int64),
+                np.frombuffer(self._counters, dtype=np.int64),
+            )
+        return self._arrays
+
+    def get(self, key):
+        pool, keys, shapes, clock, counters = self._views()
+        h = frame_hash(key)
+        with self._lock:
+            slot = np.flatnonzero(keys == h)
+            if len(slot) == 0:
+                counters[1] += 1
+                return None
+            slot = slot[0]
+            counters[0] += 1
+            counters[3] += 1
+            clock[slot] = counters[3]
+            shape = tuple(shapes[slot])
+            return pool[slot, :int(np.prod(shape))].reshape(shape).copy()
+
+    def put(self, key, frame):
+        pool, keys, shapes, clock, counters = self._views()
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.nbytes > self.slot_bytes or frame.ndim != 3:
+            with self._lock:
+                counters[2] += 1
+            return
+        h = frame_hash(key)
+        with self._lock:
+            if (keys == h).any():
+                # another worker decoded the same frame in the meantime
+                return
+            # empty slots have clock 0 and are filled first
+            slot = int(np.argmin(clock))
+            counters[3] += 1
+            keys[slot] = h
+            shapes[slot] = frame.shape
+            clock[slot] = counters[3]
+            pool[slot, :frame.nbytes] = frame.reshape(-1)
+
+    def load(self, key, path, reduction=1):
+        if reduction > 1:
+            key = '{}@{}'.format(key, reduction)
+        frame = self.get(key)
+        if frame is None:
+            frame = np.asarray(decode_frame(path, reduction))
+            self.put(key, frame)
+        return Image.fromarray(frame)
+
+    def stats(self):
+        _, keys, _, _, counters = self._views()
+        hits, misses, bypassed = int(counters[0]), int(counters[1]), int(counters[2])
+        return {
+            'hits': hits,
+            'misses': misses,
+            'bypassed': bypassed,
+            'hit_rate': hits / max(hits + misses, 1),
+            'used_slots': int((keys != 0).sum()),
+            'num_slots': self.num_slots,
+            'size_mb': self.num_slots * self.slot_bytes / 2 ** 20,
+        }
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.stats())
@@ -0,0 +1,89 @@
+"""
+Packed frame store: the frames of every video in one contiguous uint8 array.
+
+A store is a directory holding one <video>.npy of shape [T x H x W x 3] per video
+and an index.json with the frame names and the original frame size of each video.
+The arrays are memory-mapped, so frames are sliced without decoding or copying.
+"""
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+
+class FrameStore(object):
+    def __init__(self, root):
+        self.root = str(root)
+        with open(os.path.join(self.root, 'index.json')) as f:
+            self.videos = json.load(f)['videos']
+        self._name2idx = {}
+        self._arrays = {}
+
+    def __contains__(self, video):
+        return video in self.videos
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    def names(self, video):
+        return self.videos[video]['names']
+
+    def num_frames(self, video):
+        return len(self.videos[video]['names'])
+
+    def orig_size(self, video):
+        """(width, height) of the source frames before packing"""
+        return tuple(self.videos[video]['orig_size'])
+
+    def index(self, video, name):
+        if video not in self._name2idx:
+            self._name2idx[video] = {n: i for i, n in enumerate(self.names(video))}
+        return self._name2idx[video][name]
+
+    def array(self, video):
+        if video not in self._arrays:
+            self._arrays[video] = np.load(os.path.join(self.root, self.videos[video]['file']), mmap_mode='r')
+        return self._arrays[video]
+
+    def frame(self, video, idx):
+        return self.array(video)[idx]
+
+    def frames(self, video, indices):
+        return self.array(video)[np.asarray(indices)]
+
+
+def pack_video(frame_paths, out_file, short_side=None):
+    """Decodes frame_paths into out_file, optionally resized to short_side. Returns (orig_size, shape)."""
+    first = Image.open(frame_paths[0])
+    orig_size = first.size
+    w, h = orig_size
+    if short_side is not None and min(w, h) != short_side:
+        scale = short_side / min(w, h)
+        w, h = int(round(w * scale)), int(round(h * scale))
+    array = np.lib.format.open_memmap(out_file, mode='w+', dtype=np.uint8, shape=(len(frame_paths), h, w, 3))
+    for i, path in enumerate(frame_paths):
+        im = Image.open(path).convert('RGB')
+        if im.size != (w, h):
+            im = im.resize((w, h), Image.BILINEAR)
+        array[i] = np.asarray(im)
+    array.flush()
+    return orig_size, array.shape
+
+
+def pack_frames(frame_root, out_root, short_side=None):
+    os.makedirs(out_root, exist_ok=True)
+    videos = {}
+    video_names = sorted(os.listdir(frame_root))
+    for n, video in enumerate(video_names):
+        names = sorted(os.listdir(os.path.join(frame_root, video)))
+        file = video + '.npy'
+        orig_size, shape = pack_video([os.path.join(frame_root, video, name) for name in names],
+                                      os.path.join(out_root, file), short_side=short_side)
+        videos[video] = {'file': file, 'names': names, 'orig_size': list(orig_size), 'shape': list(shape)}
+        if n % 100 == 0:
+            print('frame store: {}/{}'.format(n + 1, len(video_names)))
+    with open(os.path.join(out_root, 'index.json'), 'w') as f:
+        json.dump({'videos': videos, 'short_side': short_side}, f)
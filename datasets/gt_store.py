@@ -0,0 +1,120 @@
+"""
+Consolidated A2D-Sentences ground truth.
+
+The per-frame %05d.h5 files are converted once into a single HDF5 file holding,
+for every (video, frame, instance), the bit-packed mask already transposed to
+[H x W], the reBBox box, the class id and the mask area. Frames whose h5 file
+stores a single 2D mask are recorded with instance id -1 and match any query.
+"""
+import os
+
+import h5py
+import numpy as np
+
+
+SINGLE_INSTANCE = -1
+
+
+def read_a2d_h5(h5_path):
+    """Yields (instance_id, mask [H x W], box, class_id) for every instance of an A2D h5 file."""
+    with h5py.File(h5_path, mode='r') as fp:
+        instance = np.asarray(fp['instance'])
+        all_masks = np.asarray(fp['reMask'])
+        all_boxes = np.asarray(fp['reBBox']).transpose([1, 0])  # [w_min, h_min, w_max, h_max]
+        all_ids = np.asarray(fp['id'])
+    assert len(all_masks.shape) == 2 or len(all_masks.shape) == 3
+    if len(all_masks.shape) == 2:
+        yield SINGLE_INSTANCE, all_masks.transpose(1, 0), all_boxes[0], int(all_ids[0][0])
+        return
+    if instance.shape[0] != all_masks.shape[0]:
+        print(h5_path, instance.shape, all_masks.shape)
+    for idx in range(min(instance.shape[0], all_masks.shape[0])):
+        yield int(instance[idx]), all_masks[idx].transpose(1, 0), all_boxes[idx], int(all_ids[0][idx])
+
+
+def convert_a2d_gt(annotation_root, out_file):
+    keys, offsets, shapes, boxes, class_ids, areas = [], [0], [], [], [], []
+    bits = []
+    seen = set()
+    videos = sorted(os.listdir(annotation_root))
+    for n, video in enumerate(videos):
+        for name in sorted(os.listdir(os.path.join(annotation_root, video))):
+            frame = int(name[:-3]) - 1
+            for instance_id, mask, box, class_id in read_a2d_h5(os.path.join(annotation_root, video, name)):
+                key = '{}/{}/{}'.format(video, frame, instance_id)
+                if key in seen:
+                    # the h5 readers always picked the first mask of an instance
+                    continue
+                seen.add(key)
+                mask = np.ascontiguousarray(mask, dtype=np.uint8)
+                packed = np.packbits(mask.reshape(-1))
+                keys.append(key)
+                bits.append(packed)
+                offsets.append(offsets[-1] + packed.size)
+                shapes.append(mask.shape)
+                boxes.append(box)
+                class_ids.append(class_id)
+                areas.append(int(mask.sum()))
+        if n % 100 == 0:
+            print('a2d gt store: {}/{}'.format(n + 1, len(videos)))
+    with h5py.File(out_file, 'w') as fp:
+        fp.create_dataset('keys', data=np.asarray(keys, dtype='S'))
+        fp.create_dataset('bits', data=np.concatenate(bits))
+        fp.create_dataset('offsets', data=np.asarray(offsets, dtype=np.int64))
+        fp.create_dataset('shapes', data=np.asarray(shapes, dtype=np.int32))
+        fp.create_dataset('boxes', data=np.asarray(boxes, dtype=np.float32))
+        fp.create_dataset('class_ids', data=np.asarray(class_ids, dtype=np.int64))
+        fp.create_dataset('areas', data=np.asarray(areas, dtype=np.int64))
+
+
+class A2DGroundTruthStore(object):
+    """Reader for the file written by convert_a2d_gt.
+
+    The index is loaded eagerly, the HDF5 handle is opened lazily once per
+    process and kept open, so DataLoader workers each get their own handle.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with h5py.File(self.path, mode='r') as fp:
+            keys = [k.decode() for k in fp['keys'][()]]
+            self.offsets = fp['offsets'][()]
+            self.shapes = fp['shapes'][()]
+            self.boxes = fp['boxes'][()]
+            self.class_ids = fp['class_ids'][()]
+            self.areas = fp['areas'][()]
+        self.key2row = {k: i for i, k in enumerate(keys)}
+        self.frames = set(k.rsplit('/', 1)[0] for k in keys)
+        self._fp = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fp'] = None
+        state['_pid'] = None
+        return state
+
+    def _bits(self):
+        if self._fp is None or self._pid != os.getpid():
+            self._fp = h5py.File(self.path, mode='r')
+            self._pid = os.getpid()
+        return self._fp['bits']
+
+    def has_frame(self, video_id, frame_idx):
+        return '{}/{}'.format(video_id, frame_idx) in self.frames
+
+    def row(self, video_id, frame_idx, instance_id):
+        row = self.key2row.get('{}/{}/{}'.format(video_id, frame_idx, instance_id))
+        if row is None:
+            row = self.key2row['{}/{}/{}'.format(video_id, frame_idx, SINGLE_INSTANCE)]
+        return row
+
+    def mask(self, row):
+        h, w = self.shapes[row]
+        packed = self._bits()[self.offsets[row]:self.offsets[row + 1]]
+        return np.unpackbits(packed, count=h * w).reshape(h, w)
+
+    def get(self, video_id, frame_idx, instance_id):
+        """Returns (mask [H x W] uint8, box [4], class_id, area) of one instance."""
+        row = self.row(video_id, frame_idx, int(instance_id))
+        return self.mask(row), self.boxes[row], int(self.class_ids[row]), int(self.areas[row])
@@ -0,0 +1,50 @@
+"""
+Cached dataset manifests.
+
+Parsing the annotation files of a dataset is done once; the resulting indices are
+pickled to <cache_dir>/<name>-<digest>.pkl, where the digest covers the manifest
+version and the path, mtime and size of every source file, so editing a source
+file or bumping MANIFEST_VERSION invalidates the cache. A directory's mtime only
+changes when entries are added to, removed from or renamed in it, so a manifest
+built from the contents of nested directories must list each of them as a source.
+"""
+import hashlib
+import os
+import pickle
+
+
+# bump whenever the layout of a manifest changes
+MANIFEST_VERSION = 2
+
+
+def source_signature(sources):
+    signature = [MANIFEST_VERSION]
+    for path in sources:
+        path = os.path.abspath(str(path))
+        st = os.stat(path)
+        signature.append((path, st.st_mtime_ns, st.st_size))
+    return hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+
+def load_manifest(cache_dir, name, sources, build_fn):
+    """Returns the manifest of name, calling build_fn() only if no valid cached copy exists.
+
+    With an empty cache_dir the manifest is always rebuilt and never written.
+    """
+    if not cache_dir:
+        return build_fn()
+    path = os.path.join(str(cache_dir), '{}-{}.pkl'.format(name, source_signature(sources)))
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    manifest = build_fn()
+    try:
+        os.makedirs(str(cache_dir), exist_ok=True)
+        # written under a temporary name so concurrent jobs never read a partial file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        print('could not write manifest {}: {}'.format(path, e))
+    return manifest
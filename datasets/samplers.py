@@ -0,0 +1,198 @@
+"""
+Samplers and helpers to load the source and target domains as pairs from one DataLoader.
+"""
+import heapq
+import math
+
+import numpy as np
+from torch.utils.data import Dataset, Sampler
+
+from util.misc import get_rank, get_world_size
+
+
+class PairedDataset(Dataset):
+    """Indexed with (source_index, target_index), returns (source[source_index], target[target_index])."""
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, index):
+        source_index, target_index = index
+        return self.source[source_index], self.target[target_index]
+
+
+class PairedBatchSampler(Sampler):
+    """Batches of (source_index, target_index) pairs for PairedDataset.
+
+    An epoch is one pass of source_sampler. target_sampler is cycled endlessly: a
+    new pass starts when the previous one is exhausted, with its own epoch counter
+    passed to set_epoch when the sampler supports it, and a pass may continue into
+    the next source epoch. Every batch holds as many target as source samples, so
+    the loader prefetches both domains at the same depth.
+    """
+
+    def __init__(self, source_sampler, target_sampler, batch_size, drop_last=True):
+        self.source_sampler = source_sampler
+        self.target_sampler = target_sampler
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.target_epoch = 0
+        self._target_iter = None
+
+    def set_epoch(self, epoch):
+        if hasattr(self.source_sampler, 'set_epoch'):
+            self.source_sampler.set_epoch(epoch)
+
+    def _next_target(self):
+        if self._target_iter is not None:
+            index = next(self._target_iter, None)
+            if index is not None:
+                return index
+            self.target_epoch += 1
+        if hasattr(self.target_sampler, 'set_epoch'):
+            self.target_sampler.set_epoch(self.target_epoch)
+        self._target_iter = iter(self.target_sampler)
+        return next(self._target_iter)
+
+    def __iter__(self):
+        batch = []
+        for source_index in self.source_sampler:
+            batch.append((source_index, self._next_target()))
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0 and not self.drop_last:
+            yield batch
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.source_sampler) // self.batch_size
+        return (len(self.source_sampler) + self.batch_size - 1) // self.batch_size
+
+
+class PairedCollator(object):
+    """Collates a batch of (source, target) samples into (source_batch, target_batch)."""
+
+    def __init__(self, source_collate_fn, target_collate_fn):
+        self.source_collate_fn = source_collate_fn
+        self.target_collate_fn = target_collate_fn
+
+    def __call__(self, batch):
+        source, target = zip(*batch)
+        return self.source_collate_fn(list(source)), self.target_collate_fn(list(target))
+
+
+class VideoAffinitySampler(Sampler):
+    """Distributed sampler that gives every rank whole videos, for frame and feature cache reuse.
+
+    video_ids holds the video of every sample. Each epoch the videos are shuffled
+    and dealt to the rank holding the fewest samples so far, so the shards differ
+    by at most one video; they are then wrapped or cut to the same length, as
+    every rank must run the same number of steps. Within a shard the samples of a
+    video stay close: the order of the videos is random, and samples are only
+    shuffled inside windows of `window` consecutive positions.
+    """
+
+    def __init__(self, video_ids, num_replicas=None, rank=None, shuffle=True, window=64, seed=0):
+        if num_replicas is None:
+            num_replicas = get_world_size()
+        if rank is None:
+            rank = get_rank()
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.window = window
+        self.seed = seed
+        self.epoch = 0
+        video_ids = np.asarray(video_ids)
+        order = np.argsort(video_ids, kind='stable')
+        _, starts = np.unique(video_ids[order], return_index=True)
+        # indices of the samples of every video
+        self.videos = np.split(order, starts[1:])
+        self.num_samples = int(math.ceil(len(video_ids) / self.num_replicas))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        video_order = rng.permutation(len(self.videos)) if self.shuffle else np.arange(len(self.videos))
+        loads = [(0, r) for r in range(self.num_replicas)]
+        shard = []
+        for v in video_order:
+            load, r = heapq.heappop(loads)
+            if r == self.rank:
+                shard.append(self.videos[v])
+            heapq.heappush(loads, (load + len(self.videos[v]), r))
+        indices = np.concatenate(shard) if shard else np.zeros(0, dtype=np.int64)
+        if self.shuffle:
+            for start in range(0, len(indices), self.window):
+                rng.shuffle(indices[start:start + self.window])
+        if len(indices) < self.num_samples:
+            indices = np.resize(indices, self.num_samples)
+        return iter(indices[:self.num_samples].tolist())
+
+
+class ShapeBucketSampler(Sampler):
+    """Reorders sampler so that consecutive runs of batch_size samples come out of the transforms at close sizes.
+
+    The random resize and crop of transforms is drawn here, for the video size of
+    every sample, and handed to the dataset along with the index as
+    (index, plan), so the output size is known before loading. Samples wait in a
+    bucket per output size, rounded up to granularity pixels, and a bucket is
+    emitted as soon as it holds batch_size samples. At the end of the pass the
+    partly filled buckets are filled up with their own samples and emitted until
+    the pass holds ceil(len(sampler) / batch_size) runs, so every pass is a whole
+    number of runs and the next one, e.g. of a target sampler cycled by
+    PairedBatchSampler, still starts on a batch boundary. Batching the stream
+    then pads each batch only up to its bucket's size.
+    """
+
+    def __init__(self, sampler, image_sizes, transforms, batch_size, granularity=32):
+        self.sampler = sampler
+        self.image_sizes = np.asarray(image_sizes)
+        self.transforms = transforms
+        self.batch_size = batch_size
+        self.granularity = granularity
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def _num_batches(self):
+        return -(-len(self.sampler) // self.batch_size)
+
+    def __len__(self):
+        return self._num_batches() * self.batch_size
+
+    def _bucket(self, w, h):
+        g = self.granularity
+        return -(-h // g), -(-w // g)
+
+    def __iter__(self):
+        buckets = {}
+        num_batches = 0
+        for index in self.sampler:
+            image_size = tuple(int(x) for x in self.image_sizes[index])
+            plan = self.transforms.plan(image_size)
+            if plan is None:
+                key, item = self._bucket(*image_size), index
+            else:
+                key, item = self._bucket(*plan[1]), (index, plan)
+            bucket = buckets.setdefault(key, [])
+            bucket.append(item)
+            if len(bucket) == self.batch_size:
+                del buckets[key]
+                num_batches += 1
+                yield from bucket
+        # each partly filled bucket makes one more run, which holds at least one new sample, so
+        # there are enough of them; those beyond the length of the pass are left out
+        for bucket in list(buckets.values())[:self._num_batches() - num_batches]:
+            yield from (bucket * self.batch_size)[:self.batch_size]
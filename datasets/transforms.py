@@ -1,10 +1,12 @@
 """
 Transforms and data augmentation for sequence level images, bboxes and masks.
 """
+import inspect
 import random
 
 import PIL
 import torch
+import torch.nn.functional as nnF
 import torchvision.transforms as T
 import torchvision.transforms.functional as F
 
@@ -50,10 +52,35 @@ def bbox_overlaps(bboxes1, bboxes2, mode='iou', eps=1e-6):
     return ious
 
 
+def get_clip_size(clip):
+    """(w, h) of a clip, either a list of PIL images or a [T x C x H x W] tensor"""
+    if isinstance(clip, torch.Tensor):
+        return clip.shape[-1], clip.shape[-2]
+    return clip[0].size
+
+
+def stack_clip(clip):
+    """Stacks a list of PIL images or a [T x H x W x C] uint8 array into a [T x C x H x W] uint8 tensor.
+
+    The sequence transforms below accept such a tensor in place of a list of PIL
+    images and then run every op once on the whole clip.
+    """
+    if not isinstance(clip, np.ndarray):
+        clip = np.stack([np.asarray(img) for img in clip])
+    return torch.from_numpy(np.ascontiguousarray(clip)).permute(0, 3, 1, 2)
+
+
+def crop_clip(clip, region):
+    i, j, h, w = region
+    if isinstance(clip, torch.Tensor):
+        return clip[..., i:i + h, j:j + w]
+    return [F.crop(image, *region) for image in clip]
+
+
 def crop(clip, target, region):
-    cropped_image = []
-    for image in clip:
-        cropped_image.append(F.crop(image, *region))
+    cropped_image = crop_clip(clip, region)
+    if target is None:
+        return cropped_image, None
 
     target = target.copy()
     i, j, h, w = region
@@ -83,11 +110,14 @@ def crop(clip, target, region):
 
 
 def hflip(clip, target):
-    flipped_image = []
-    for image in clip:
-        flipped_image.append(F.hflip(image))
+    if isinstance(clip, torch.Tensor):
+        flipped_image = clip.flip(-1)
+    else:
+        flipped_image = [F.hflip(image) for image in clip]
 
-    w, h = clip[0].size
+    w, h = get_clip_size(clip)
+    if target is None:
+        return flipped_image, None
 
     target = target.copy()
     if "boxes" in target:
@@ -100,11 +130,12 @@ def hflip(clip, target):
     
     return flipped_image, target
 
-def vflip(image,target):
-    flipped_image = []
-    for image in clip:
-        flipped_image.append(F.vflip(image))
-    w, h = clip[0].size
+def vflip(clip, target):
+    if isinstance(clip, torch.Tensor):
+        flipped_image = clip.flip(-2)
+    else:
+        flipped_image = [F.vflip(image) for image in clip]
+    w, h = get_clip_size(clip)
     target = target.copy()
     if "boxes" in target:
         boxes = target["boxes"]
@@ -116,44 +147,71 @@ def vflip(image,target):
 
     return flipped_image, target
 
-def resize(clip, target, size, max_size=None):
-    # size can be min_size (scalar) or (w, h) tuple
+def get_size_with_aspect_ratio(image_size, size, max_size=None):
+    w, h = image_size
+    if max_size is not None:
+        min_original_size = float(min((w, h)))
+        max_original_size = float(max((w, h)))
+        if max_original_size / min_original_size * size > max_size:
+            size = int(round(max_size * min_original_size / max_original_size))
 
-    def get_size_with_aspect_ratio(image_size, size, max_size=None):
-        w, h = image_size
-        if max_size is not None:
-            min_original_size = float(min((w, h)))
-            max_original_size = float(max((w, h)))
-            if max_original_size / min_original_size * size > max_size:
-                size = int(round(max_size * min_original_size / max_original_size))
-
-        if (w <= h and w == size) or (h <= w and h == size):
-            return (h, w)
-
-        if w < h:
-            ow = size
-            oh = int(size * h / w)
-        else:
-            oh = size
-            ow = int(size * w / h)
+    if (w <= h and w == size) or (h <= w and h == size):
+        return (h, w)
 
-        return (oh, ow)
+    if w < h:
+        ow = size
+        oh = int(size * h / w)
+    else:
+        oh = size
+        ow = int(size * w / h)
+
+    return (oh, ow)
+
+
+def get_size(image_size, size, max_size=None):
+    # size can be min_size (scalar) or (w, h) tuple, returns (h, w)
+    if isinstance(size, (list, tuple)):
+        return size[::-1]
+    else:
+        return get_size_with_aspect_ratio(image_size, size, max_size)
+
+
+# antialiased interpolate (torch >= 1.11) follows the PIL resampling filters
+_HAS_ANTIALIAS = 'antialias' in inspect.signature(nnF.interpolate).parameters
 
-    def get_size(image_size, size, max_size=None):
-        if isinstance(size, (list, tuple)):
-            return size[::-1]
-        else:
-            return get_size_with_aspect_ratio(image_size, size, max_size)
 
-    size = get_size(clip[0].size, size, max_size)
-    rescaled_image = []
-    for image in clip:
-        rescaled_image.append(F.resize(image, size))
+def resize_tensor(clip, size):
+    """Bilinear resize of a [T x C x H x W] clip to size (h, w), antialiased like PIL when shrinking.
+
+    Without antialias support the frames are resampled as by F.resize, which
+    aliases when they are shrunk, so the results then differ from the PIL path.
+    """
+    if not _HAS_ANTIALIAS:
+        return F.resize(clip, list(size))
+    resized = nnF.interpolate(clip.float(), size=tuple(size), mode='bilinear', align_corners=False, antialias=True)
+    if clip.dtype == torch.uint8:
+        return resized.round_().clamp_(0, 255).to(torch.uint8)
+    return resized.to(clip.dtype)
+
+
+def resize(clip, target, size, max_size=None):
+    # size can be min_size (scalar) or (w, h) tuple
+    orig_size = get_clip_size(clip)
+    size = get_size(orig_size, size, max_size)
+    if isinstance(clip, torch.Tensor):
+        rescaled_image = resize_tensor(clip, size)
+    else:
+        rescaled_image = [F.resize(image, size) for image in clip]
 
     if target is None:
         return rescaled_image, None
 
-    ratios = tuple(float(s) / float(s_orig) for s, s_orig in zip(rescaled_image[0].size, clip[0].size))
+    return rescaled_image, resize_target(target, orig_size, get_clip_size(rescaled_image))
+
+
+def resize_target(target, orig_size, new_size):
+    # orig_size and new_size are (w, h) image sizes
+    ratios = tuple(float(s) / float(s_orig) for s, s_orig in zip(new_size, orig_size))
     ratio_width, ratio_height = ratios
 
     target = target.copy()
@@ -167,7 +225,8 @@ def resize(clip, target, size, max_size=None):
         scaled_area = area * (ratio_width * ratio_height)
         target["area"] = scaled_area
 
-    h, w = size
+    w, h = new_size
+    size = (h, w)
     target["size"] = torch.tensor([h, w])
 
     if "masks" in target:
@@ -176,19 +235,58 @@ def resize(clip, target, size, max_size=None):
                 target['masks'][:, None].float(), size, mode="nearest")[:, 0] > 0.5
         else:
             target['masks'] = torch.zeros((target['masks'].shape[0],h,w))
-    return rescaled_image, target
+    return target
+
+
+def resized_crop(clip, target, box, size):
+    """Crops box (x0, y0, x1, y1) and resizes it to size (w, h) with a single resample.
+
+    The box may have fractional coordinates; the tensor backend rounds it to whole pixels.
+    """
+    w, h = size
+    if isinstance(clip, torch.Tensor):
+        box = tuple(int(round(v)) for v in box)
+        x0, y0, x1, y1 = box
+        resampled_image = resize_tensor(F.crop(clip, y0, x0, y1 - y0, x1 - x0), (h, w))
+    else:
+        resampled_image = [image.resize((w, h), Image.BILINEAR, box=tuple(box)) for image in clip]
+    if target is None:
+        return resampled_image, None
+
+    x0, y0, x1, y1 = box
+    ratio_width, ratio_height = w / (x1 - x0), h / (y1 - y0)
+    target = target.copy()
+    target["size"] = torch.tensor([h, w])
+
+    if "boxes" in target:
+        boxes = target["boxes"] - torch.as_tensor([x0, y0, x0, y0], dtype=torch.float32)
+        boxes = boxes * torch.as_tensor([ratio_width, ratio_height, ratio_width, ratio_height])
+        boxes = torch.min(boxes.reshape(-1, 2, 2), torch.as_tensor([w, h], dtype=torch.float32)).clamp(min=0)
+        target["area"] = (boxes[:, 1, :] - boxes[:, 0, :]).prod(dim=1)
+        target["boxes"] = boxes.reshape(-1, 4)
+    elif "area" in target:
+        target["area"] = target["area"] * (ratio_width * ratio_height)
+
+    if "masks" in target:
+        # nearest neighbour: one gather of the source row and column of every output pixel
+        masks = target['masks']
+        rows = ((torch.arange(h) + 0.5) / ratio_height + y0).long().clamp(0, masks.shape[-2] - 1)
+        cols = ((torch.arange(w) + 0.5) / ratio_width + x0).long().clamp(0, masks.shape[-1] - 1)
+        target['masks'] = masks[:, rows][:, :, cols] > 0
+    return resampled_image, target
 
 
 def pad(clip, target, padding):
     # assumes that we only pad on the bottom right corners
-    padded_image = []
-    for image in clip:
-        padded_image.append(F.pad(image, (0, 0, padding[0], padding[1])))
+    if isinstance(clip, torch.Tensor):
+        padded_image = torch.nn.functional.pad(clip, (0, padding[0], 0, padding[1]))
+    else:
+        padded_image = [F.pad(image, (0, 0, padding[0], padding[1])) for image in clip]
     if target is None:
         return padded_image, None
     target = target.copy()
     # should we do something wrt the original size?
-    target["size"] = torch.tensor(padded_image[0].size[::-1])
+    target["size"] = torch.tensor(get_clip_size(padded_image)[::-1])
     if "masks" in target:
         target['masks'] = torch.nn.functional.pad(target['masks'], (0, padding[0], 0, padding[1]))
     return padded_image, target
@@ -199,7 +297,7 @@ class RandomCrop(object):
         self.size = size
 
     def __call__(self, img, target):
-        region = T.RandomCrop.get_params(img, self.size)
+        region = T.RandomCrop.get_params(img[0], self.size)
         return crop(img, target, region)
 
 
@@ -209,8 +307,9 @@ class RandomSizeCrop(object):
         self.max_size = max_size
 
     def __call__(self, img: PIL.Image.Image, target: dict):
-        w = random.randint(self.min_size, min(img[0].width, self.max_size))
-        h = random.randint(self.min_size, min(img[0].height, self.max_size))
+        img_w, img_h = get_clip_size(img)
+        w = random.randint(self.min_size, min(img_w, self.max_size))
+        h = random.randint(self.min_size, min(img_h, self.max_size))
         region = T.RandomCrop.get_params(img[0], [h, w])
         return crop(img, target, region)
 
@@ -220,7 +319,7 @@ class CenterCrop(object):
         self.size = size
 
     def __call__(self, img, target):
-        image_width, image_height = img.size
+        image_width, image_height = get_clip_size(img)
         crop_height, crop_width = self.size
         crop_top = int(round((image_height - crop_height) / 2.))
         crop_left = int(round((image_width - crop_width) / 2.))
@@ -234,7 +333,7 @@ class MinIoURandomCrop(object):
         self.min_crop_size = min_crop_size
 
     def __call__(self, img, target):
-        w,h = img.size
+        w, h = get_clip_size(img)
         while True:
             mode = random.choice(self.sample_mode)
             self.mode = mode
@@ -275,9 +374,8 @@ class MinIoURandomCrop(object):
                     boxes -= np.tile(patch[:2], 2)
                     target['boxes'] = torch.tensor(boxes)
                 
-                img = np.asarray(img)[patch[1]:patch[3], patch[0]:patch[2]]
-                img = Image.fromarray(img)
-                width, height = img.size
+                img = crop_clip(img, (patch[1], patch[0], patch[3] - patch[1], patch[2] - patch[0]))
+                width, height = get_clip_size(img)
                 target['orig_size'] = torch.tensor([height,width])
                 target['size'] = torch.tensor([height,width])
                 return img,target 
@@ -365,6 +463,8 @@ class SwapChannels(object):
         return image
 
 class PhotometricDistort(object):
+    keeps_size = True
+
     def __init__(self):
         self.pd = [
             RandomContrast(),
@@ -391,6 +491,70 @@ class PhotometricDistort(object):
             imgs.append(Image.fromarray(img.astype('uint8')))
         return imgs, target
 
+class ClipPhotometricDistort(object):
+    """PhotometricDistort applied to the whole clip at once.
+
+    The frames are stacked into one [T x H x W x 3] float32 array and every step is a
+    broadcast operation; the two color conversions run as a single cv2 call on the
+    [T*H x W x 3] view. The random parameters are drawn once per clip, or once per
+    frame with per_frame=True, which gives the same distribution as PhotometricDistort.
+    """
+    perms = ((0, 1, 2), (0, 2, 1),
+             (1, 0, 2), (1, 2, 0),
+             (2, 0, 1), (2, 1, 0))
+    keeps_size = True
+
+    def __init__(self, per_frame=False, contrast=(0.5, 1.5), saturation=(0.5, 1.5), hue=18.0, brightness=32):
+        self.per_frame = per_frame
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.brightness = brightness
+
+    def draw(self, n):
+        """Random parameters of n frames, each with shape [n]."""
+        def maybe(value, default):
+            return np.where(rand.randint(2, size=n), value, default)
+        return {
+            'brightness': maybe(rand.uniform(-self.brightness, self.brightness, size=n), 0.),
+            'contrast_first': rand.randint(2, size=n).astype(bool),
+            'contrast': maybe(rand.uniform(*self.contrast, size=n), 1.),
+            'saturation': maybe(rand.uniform(*self.saturation, size=n), 1.),
+            'hue': maybe(rand.uniform(-self.hue, self.hue, size=n), 0.),
+            'perm': maybe(rand.randint(len(self.perms), size=n), 0),
+        }
+
+    def apply(self, clip, params):
+        """Distorts clip, a [T x H x W x 3] float32 array, in place where possible."""
+        t, h, w, _ = clip.shape
+        p = params
+        clip += p['brightness'][:, None, None, None]
+        clip *= np.where(p['contrast_first'], p['contrast'], 1.)[:, None, None, None]
+        # the frames are RGB, but the per-frame path always treated them as BGR
+        hsv = cv2.cvtColor(clip.reshape(t * h, w, 3), cv2.COLOR_BGR2HSV).reshape(t, h, w, 3)
+        hsv[..., 1] *= p['saturation'][:, None, None]
+        hue = hsv[..., 0]
+        hue += p['hue'][:, None, None]
+        hue[hue > 360.0] -= 360.0
+        hue[hue < 0.0] += 360.0
+        clip = cv2.cvtColor(hsv.reshape(t * h, w, 3), cv2.COLOR_HSV2BGR).reshape(t, h, w, 3)
+        clip *= np.where(p['contrast_first'], 1., p['contrast'])[:, None, None, None]
+        perm = np.asarray(self.perms)[p['perm']]
+        if (perm != self.perms[0]).any():
+            clip = np.take_along_axis(clip, perm[:, None, None, :], axis=3)
+        return clip
+
+    def __call__(self, clip, target):
+        if isinstance(clip, torch.Tensor):
+            frames = clip.permute(0, 2, 3, 1).numpy().astype('float32')
+        else:
+            frames = np.stack([np.asarray(img) for img in clip]).astype('float32')
+        params = self.draw(len(frames) if self.per_frame else 1)
+        frames = self.apply(frames, params).astype('uint8')
+        if isinstance(clip, torch.Tensor):
+            return torch.from_numpy(frames).permute(0, 3, 1, 2), target
+        return [Image.fromarray(frame) for frame in frames], target
+
 #NOTICE: if used for mask, need to change
 class Expand(object):
     def __init__(self, mean):
@@ -398,13 +562,16 @@ class Expand(object):
     def __call__(self, clip, target):
         if rand.randint(2):
             return clip,target
+        width, height = get_clip_size(clip)
+        ratio = rand.uniform(1, 4)
+        left = rand.uniform(0, width*ratio - width)
+        top = rand.uniform(0, height*ratio - height)
+        if isinstance(clip, torch.Tensor):
+            return self.expand_tensor(clip, target, ratio, int(left), int(top))
         imgs = []
         masks = []
         image = np.asarray(clip[0]).astype('float32')
         height, width, depth = image.shape
-        ratio = rand.uniform(1, 4)
-        left = rand.uniform(0, width*ratio - width)
-        top = rand.uniform(0, height*ratio - height)
         for i in range(len(clip)):
             image = np.asarray(clip[i]).astype('float32')
             expand_image = np.zeros((int(height*ratio), int(width*ratio), depth),dtype=image.dtype)
@@ -421,7 +588,21 @@ class Expand(object):
         target['masks']=torch.stack(masks)
         return imgs, target
 
+    def expand_tensor(self, clip, target, ratio, left, top):
+        t, c, height, width = clip.shape
+        expand_image = clip.new_empty((t, c, int(height*ratio), int(width*ratio)))
+        expand_image[:] = torch.as_tensor(self.mean, dtype=torch.float32).to(clip.dtype).reshape(1, -1, 1, 1)
+        expand_image[..., top:top + height, left:left + width] = clip
+        masks = target['masks']
+        expand_mask = masks.new_zeros((masks.shape[0], int(height*ratio), int(width*ratio)))
+        expand_mask[:, top:top + height, left:left + width] = masks
+        target['boxes'] = target['boxes'] + torch.as_tensor([left, top, left, top], dtype=target['boxes'].dtype)
+        target['masks'] = expand_mask
+        return expand_image, target
+
 class RandomHorizontalFlip(object):
+    keeps_size = True
+
     def __init__(self, p=0.5):
         self.p = p
 
@@ -431,6 +612,8 @@ class RandomHorizontalFlip(object):
         return img, target
 
 class RandomVerticalFlip(object):
+    keeps_size = True
+
     def __init__(self, p=0.5):
         self.p = p
 
@@ -445,12 +628,77 @@ class RandomResize(object):
         assert isinstance(sizes, (list, tuple))
         self.sizes = sizes
         self.max_size = max_size
+        self._next_size = None
+
+    def decode_scale(self, image_size):
+        """Draws the size of the next call, returns by how much frames of image_size may be shrunk before it."""
+        self._next_size = random.choice(self.sizes)
+        h, w = get_size(image_size, self._next_size, self.max_size)
+        return min(image_size[0] / w, image_size[1] / h)
 
     def __call__(self, img, target=None):
-        size = random.choice(self.sizes)
+        size, self._next_size = self._next_size, None
+        if size is None:
+            size = random.choice(self.sizes)
         return resize(img, target, size, self.max_size)
 
 
+class FusedRandomResizeCrop(object):
+    """RandomResize(scales, max_size), RandomResize(crop_scales), RandomSizeCrop(*crop_size) and
+    RandomResize(final_scales, final_max_size) composed into one crop and one resample.
+
+    The random draws are those of the chained transforms; plan() maps the crop back
+    to the input frames, which are then resampled once, directly to the final size.
+    """
+    def __init__(self, scales, max_size, crop_scales, crop_size, final_scales, final_max_size=None):
+        self.scales = scales
+        self.max_size = max_size
+        self.crop_scales = crop_scales
+        self.crop_size = crop_size
+        self.final_scales = final_scales
+        self.final_max_size = final_max_size
+        self._next_plan = None
+
+    def plan(self, image_size):
+        """Returns the crop box (x0, y0, x1, y1) in input pixels and the output size (w, h)."""
+        w, h = image_size
+        h1, w1 = get_size((w, h), random.choice(self.scales), self.max_size)
+        h2, w2 = get_size((w1, h1), random.choice(self.crop_scales))
+        min_size, max_size = self.crop_size
+        crop_w = random.randint(min_size, min(w2, max_size))
+        crop_h = random.randint(min_size, min(h2, max_size))
+        top = random.randint(0, h2 - crop_h)
+        left = random.randint(0, w2 - crop_w)
+        h3, w3 = get_size((crop_w, crop_h), random.choice(self.final_scales), self.final_max_size)
+        scale_w, scale_h = w2 / w, h2 / h
+        box = (left / scale_w, top / scale_h, (left + crop_w) / scale_w, (top + crop_h) / scale_h)
+        return box, (w3, h3)
+
+    def use_plan(self, image_size, plan):
+        """Makes the next call apply plan, drawn beforehand for frames of image_size."""
+        box, size = plan
+        self._next_plan = tuple(image_size), box, size
+
+    def decode_scale(self, image_size):
+        """Draws the plan of the next call, returns by how much frames of image_size may be shrunk before it."""
+        if self._next_plan is None or self._next_plan[0] != tuple(image_size):
+            self.use_plan(image_size, self.plan(image_size))
+        _, box, (w, h) = self._next_plan
+        return min((box[2] - box[0]) / w, (box[3] - box[1]) / h)
+
+    def __call__(self, img, target):
+        clip_size = get_clip_size(img)
+        if self._next_plan is None:
+            box, size = self.plan(clip_size)
+        else:
+            # the plan was drawn for the full-size frames, which were decoded at a reduced size
+            (plan_w, plan_h), box, size = self._next_plan
+            self._next_plan = None
+            scale_w, scale_h = clip_size[0] / plan_w, clip_size[1] / plan_h
+            box = (box[0] * scale_w, box[1] * scale_h, box[2] * scale_w, box[3] * scale_h)
+        return resized_crop(img, target, box, size)
+
+
 class RandomPad(object):
     def __init__(self, max_pad):
         self.max_pad = max_pad
@@ -479,6 +727,8 @@ class RandomSelect(object):
 
 class ToTensor(object):
     def __call__(self, clip, target):
+        if isinstance(clip, torch.Tensor):
+            return clip.float().div_(255), target
         img = []
         for im in clip:
             img.append(F.to_tensor(im))
@@ -500,19 +750,40 @@ class Normalize(object):
         self.std = std
 
     def __call__(self, clip, target=None):
-        image = []
-        for im in clip:
-            image.append(F.normalize(im, mean=self.mean, std=self.std))
+        if isinstance(clip, torch.Tensor):
+            image = F.normalize(clip, mean=self.mean, std=self.std)
+        else:
+            image = [F.normalize(im, mean=self.mean, std=self.std) for im in clip]
         if target is None:
             return image, None
-        target = target.copy()
         h, w = image[0].shape[-2:]
-        if "boxes" in target:
-            boxes = target["boxes"]
-            boxes = box_xyxy_to_cxcywh(boxes)
-            boxes = boxes / torch.tensor([w, h, w, h], dtype=torch.float32)
-            target["boxes"] = boxes
-        return image, target
+        return image, normalize_boxes(target, w, h)
+
+
+def normalize_boxes(target, w, h):
+    target = target.copy()
+    if "boxes" in target:
+        boxes = target["boxes"]
+        boxes = box_xyxy_to_cxcywh(boxes)
+        boxes = boxes / torch.tensor([w, h, w, h], dtype=torch.float32)
+        target["boxes"] = boxes
+    return target
+
+
+class ToUint8Tensor(object):
+    """Ends a pipeline in place of ToTensor + Normalize, for uint8 transport to the main process.
+
+    The clip becomes a [T x C x H x W] uint8 tensor, which is normalized on the
+    device by util.misc.normalize_nested_tensor; the boxes are normalized here as
+    Normalize does.
+    """
+    def __call__(self, clip, target=None):
+        if not isinstance(clip, torch.Tensor):
+            clip = stack_clip(clip)
+        if target is None:
+            return clip, None
+        h, w = clip.shape[-2:]
+        return clip, normalize_boxes(target, w, h)
 
 
 class Compose(object):
@@ -524,6 +795,33 @@ class Compose(object):
             image, target = t(image, target)
         return image, target
 
+    def _first_resample(self):
+        # the first transform that resamples the frames, None if one that does not plan ahead comes first
+        for t in self.transforms:
+            if hasattr(t, 'decode_scale'):
+                return t
+            if not getattr(t, 'keeps_size', False):
+                break
+        return None
+
+    def decode_scale(self, image_size):
+        """By how much frames of image_size may be shrunk before being transformed, without losing resolution.
+
+        Asks the first transform that resamples the frames, which then pre-draws its
+        random parameters for the next call; 1 if another transform comes first.
+        """
+        t = self._first_resample()
+        return t.decode_scale(image_size) if t is not None else 1.
+
+    def plan(self, image_size):
+        """Draws the random resample of frames of image_size, as (box, (w, h)), None if it cannot be planned."""
+        t = self._first_resample()
+        return t.plan(image_size) if t is not None and hasattr(t, 'plan') else None
+
+    def use_plan(self, image_size, plan):
+        """Makes the next call apply a plan returned by plan(image_size)."""
+        self._first_resample().use_plan(image_size, plan)
+
     def __repr__(self):
         format_string = self.__class__.__name__ + "("
         for t in self.transforms:
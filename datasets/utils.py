@@ -1,6 +1,79 @@
+import random
+
 import numpy as np
+import torch
 from PIL import Image
 import cv2
+import torch.nn.functional as nnF
+import torchvision.transforms.functional as F
+
+from .transforms import _HAS_ANTIALIAS
+
+try:
+    from torchvision.transforms import InterpolationMode
+    BICUBIC = InterpolationMode.BICUBIC
+except ImportError:
+    BICUBIC = Image.BICUBIC
+
+
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def clip_view(clip, n_px=224):
+    """The CLIP input of a [T x 3 x H x W] uint8 clip, or a list of PIL frames, as uint8: a bicubic resize and center crop.
+
+    All frames are resized at once, antialiased as by the PIL resize of the CLIP
+    preprocess; without antialias support they are resized one by one with PIL.
+    Normalization is left to the consumer (normalize_clip_view), so the view is
+    shipped from the loader workers at a quarter of the float32 size.
+    """
+    if not _HAS_ANTIALIAS:
+        if isinstance(clip, torch.Tensor):
+            clip = [F.to_pil_image(frame) for frame in clip]
+        view = np.stack([np.asarray(F.center_crop(F.resize(frame.convert('RGB'), n_px, interpolation=BICUBIC), n_px))
+                         for frame in clip])
+        return torch.from_numpy(view).permute(0, 3, 1, 2).contiguous()
+    if not isinstance(clip, torch.Tensor):
+        clip = torch.from_numpy(np.stack([np.asarray(frame.convert('RGB')) for frame in clip])).permute(0, 3, 1, 2)
+    h, w = clip.shape[-2:]
+    # the size of Resize(n_px): the short side to n_px
+    size = (n_px, int(n_px * w / h)) if h <= w else (int(n_px * h / w), n_px)
+    view = nnF.interpolate(clip.float(), size=size, mode='bicubic', align_corners=False, antialias=True)
+    top, left = int(round((size[0] - n_px) / 2.)), int(round((size[1] - n_px) / 2.))
+    view = view[:, :, top:top + n_px, left:left + n_px]
+    return view.round_().clamp_(0, 255).to(torch.uint8)
+
+
+def normalize_clip_view(view):
+    """Normalizes a uint8 CLIP view with the CLIP mean and std, on the device of view."""
+    mean = torch.as_tensor(CLIP_MEAN, device=view.device).view(1, 3, 1, 1)
+    std = torch.as_tensor(CLIP_STD, device=view.device).view(1, 3, 1, 1)
+    return (view.float().div_(255) - mean) / std
+
+
+def string_array(strings):
+    """Fixed-width utf-8 byte strings, so the table is one buffer shared by forked workers."""
+    return np.asarray([s.encode() for s in strings], dtype=np.bytes_)
+
+
+def sample_negative_queries(num_samples, num_queries, num_negatives=10, seed=None):
+    """[num_samples x num_negatives] int32 table of distinct query indices per row, like random.sample.
+
+    Without a seed, one is drawn from the `random` module, so the table follows the job seed.
+    """
+    if num_queries < num_negatives:
+        raise ValueError('cannot sample {} negatives out of {} queries'.format(num_negatives, num_queries))
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    rng = np.random.default_rng(seed)
+    negatives = rng.integers(0, num_queries, size=(num_samples, num_negatives), dtype=np.int32)
+    redraw = np.arange(num_samples)
+    while len(redraw):
+        rows = np.sort(negatives[redraw], axis=1)
+        redraw = redraw[(rows[:, 1:] == rows[:, :-1]).any(axis=1)]
+        negatives[redraw] = rng.integers(0, num_queries, size=(len(redraw), num_negatives), dtype=np.int32)
+    return negatives
 
 
 def resize(image, limit_size, interpolation=None):
@@ -19,6 +19,7 @@ import cv2
 import random
 
 import json
+import pickle
 
 import numpy as np
 
@@ -26,9 +27,17 @@ import scipy.io.wavfile as wav
 from bert_embedding import BertEmbedding
 import clip
 
+from .feature_store import ClipFeatureStore, FeatureStore, clip_frame_key
+from .frame_cache import SharedFrameCache, decode_frame, jpeg_reduction
+from .frame_store import FrameStore
+from .manifest import load_manifest
+from .utils import clip_view, sample_negative_queries, string_array
+
 
 class YTVOSDataset:
-    def __init__(self, img_folder, mask_folder, ann_file, exp_file, vocab_path, transforms, return_masks, num_frames):
+    def __init__(self, img_folder, mask_folder, ann_file, exp_file, vocab_path, transforms, return_masks, num_frames,
+                 bert_store=None, clip_store=None, frame_cache=None, frame_store=None, manifest_cache_dir=None,
+                 tensor_transforms=False, reduced_decode=False, sample_mode='full'):
         self.img_folder = img_folder
         self.mask_folder = mask_folder
         self.ann_file = ann_file
@@ -38,40 +47,50 @@ class YTVOSDataset:
         self.return_masks = return_masks
         self.num_frames = num_frames
         self.prepare = ConvertCocoPolysToMask(return_masks)
-        self.ytvos = YTVOS(ann_file)
-        # self.cat_ids = self.ytvos.getCatIds()  # 0~40
-        self.vid_ids = self.ytvos.getVidIds()  # 1~2238
-        self.vid_infos = []
-        self.exp_infos = load_expressions(exp_file)  # 表达
-        self.bert_embedding = BertEmbedding()
-        self.clip_preprocess = clip.load("RN50")[1]
-        # all_query = set()
-        self.all_query = []
-        for i in self.vid_ids:
-            info = self.ytvos.loadVids([i])[0]
-            info['filenames'] = info['file_names']
-            self.vid_infos.append(info)
-        self.img_ids = []
-        for idx, vid_info in enumerate(self.vid_infos):
-            filename = vid_info['file_names'][0].split('/')[0]
-            exps = self.exp_infos[filename]['expressions']
-            for frame_id in range(len(vid_info['filenames'])):
-                for exp_id in range(len(exps)):
-                    self.img_ids.append((idx, frame_id, exp_id))
-                    # all_query.add(exps[exp_id]['exp'])
-                    if frame_id == 0:
-                        self.all_query.append(exps[exp_id]['exp'])
-        self.extract_query = {}
-        for i in range(len(self.img_ids)):
-            numbers = random.sample(range(0, len(self.all_query)), 10)
-            self.extract_query[i] = numbers
+        manifest = load_manifest(manifest_cache_dir, 'ytvos_' + Path(ann_file).stem, [ann_file, exp_file],
+                                 lambda: build_manifest(ann_file, exp_file))
+        self.vid_infos = manifest['vid_infos']
+        self.exp_infos = manifest['exp_infos']  # 表达
+        # pickled annotations of every object, in the order of YTVOS.getAnnIds
+        self.ann_blobs = manifest['ann_blobs']
+        self.img_ids = manifest['img_ids']
+        self.all_query = manifest['all_query']
+        self.bert_store = FeatureStore(bert_store) if bert_store else None
+        self._bert_embedding = None
+        self.clip_store = ClipFeatureStore(clip_store) if clip_store else None
+        self.frame_cache = frame_cache
+        self.tensor_transforms = tensor_transforms
+        self.reduced_decode = reduced_decode
+        # 'full', or 'frames' to return only the frames and their CLIP view
+        self.sample_mode = sample_mode
+        self.frame_store = FrameStore(frame_store) if frame_store else None
+        self.extract_query = sample_negative_queries(len(self.img_ids), len(self.all_query), 10)
 
     def __len__(self):
         return len(self.img_ids)
 
+    def sample_videos(self):
+        """The video of every sample, for datasets.samplers.VideoAffinitySampler."""
+        return self.img_ids['vid']
+
+    @property
+    def bert_embedding(self):
+        # created on first use, so in each loader worker, and never when a BERT store is given
+        if self._bert_embedding is None:
+            self._bert_embedding = BertEmbedding()
+        return self._bert_embedding
+
+    def sample_sizes(self):
+        """The (width, height) of the video of every sample, for datasets.samplers.ShapeBucketSampler."""
+        sizes = np.asarray([(info['width'], info['height']) for info in self.vid_infos])
+        return sizes[self.img_ids['vid']]
+
     def __getitem__(self, idx):
-        vid, frame_id, exp_id = self.img_ids[idx]
-        vid_id = self.vid_infos[vid]['id']
+        plan = None
+        if isinstance(idx, tuple):
+            # (index, resample plan) from datasets.samplers.ShapeBucketSampler
+            idx, plan = idx
+        vid, frame_id, exp_id = (int(x) for x in self.img_ids[idx])
         img = []
         vid_len = len(self.vid_infos[vid]['file_names'])
         inds = list(range(self.num_frames))
@@ -81,6 +100,46 @@ class YTVOSDataset:
 
         filename = self.vid_infos[vid]['file_names'][0].split('/')[0]
 
+        if plan is not None:
+            self._transforms.use_plan((self.vid_infos[vid]['width'], self.vid_infos[vid]['height']), plan)
+        reduction = 1
+        if self.reduced_decode and self.frame_store is None and self._transforms is not None:
+            # decode the JPEGs no larger than the first resample of the transforms needs them
+            vid_info = self.vid_infos[vid]
+            reduction = jpeg_reduction(self._transforms.decode_scale((vid_info['width'], vid_info['height'])))
+        img_paths = []
+        for j in range(self.num_frames):
+            img_path = os.path.join(str(self.img_folder), self.vid_infos[vid]['file_names'][frame_id-inds[j]])
+        #     mask_path = os.path.join(str(self.mask_folder), self.vid_infos[vid]['file_names'][frame_id-inds[j]][:-3]+'png')
+            img_paths.append(img_path)
+            if self.frame_store is None:
+                img.append(self._load_frame(self.vid_infos[vid]['file_names'][frame_id-inds[j]], img_path, reduction))
+        clip_frames = None
+        if self.frame_store is not None:
+            frame_ids = [self.frame_store.index(filename, os.path.basename(p)) for p in img_paths]
+            frames = self.frame_store.frames(filename, frame_ids)
+            if self.tensor_transforms:
+                # the frames gathered out of the memory map are the clip of the tensor transforms
+                clip_frames = T.stack_clip(frames)
+            else:
+                img = [Image.fromarray(frame) for frame in frames]
+            # the annotations refer to the size of the unpacked frames
+            image_size = self.frame_store.orig_size(filename)
+        else:
+            # the annotations refer to the full-size frames
+            image_size = (self.vid_infos[vid]['width'], self.vid_infos[vid]['height']) if reduction > 1 else img[0].size
+        if self.tensor_transforms and clip_frames is None:
+            clip_frames = T.stack_clip(img)
+
+        if self.clip_store is not None:
+            img_clip = torch.from_numpy(self.clip_store.encode_image([clip_frame_key('ytvos', p) for p in img_paths]))
+        else:
+            img_clip = clip_view(clip_frames if clip_frames is not None else img)
+        if self.sample_mode == 'frames':
+            # the target domain only feeds its frames and their CLIP view to the adaptation losses
+            img, _ = self._apply_transforms(img, None, clip_frames)
+            return img, None, None, (img_clip, None)
+
         # bert
         expressions = []
         # expressions.append(np.zeros((7, 768)))
@@ -92,32 +151,78 @@ class YTVOSDataset:
         expressions.append(expression)
         numbers = self.extract_query[idx]
         for i in range(10):
-            query = self.all_query[numbers[i]]
+            query = self.all_query[numbers[i]].decode()
             expressions.append(query)
-        text_clip = clip.tokenize(expressions)
-        results = self.bert_embedding(expressions)
-        expressions = [np.asarray(result[1]) for result in results]
-
-        for j in range(self.num_frames):
-            img_path = os.path.join(str(self.img_folder), self.vid_infos[vid]['file_names'][frame_id-inds[j]])
-        #     mask_path = os.path.join(str(self.mask_folder), self.vid_infos[vid]['file_names'][frame_id-inds[j]][:-3]+'png')
-            img.append(Image.open(img_path).convert('RGB'))
-
-        img_clip = torch.stack([self.clip_preprocess(im) for im in img])
+        if self.clip_store is not None:
+            text_clip = torch.from_numpy(self.clip_store.encode_text(expressions))
+        else:
+            text_clip = clip.tokenize(expressions)
+        if self.bert_store is not None:
+            expressions = [self.bert_store[exp] for exp in expressions]
+        else:
+            results = self.bert_embedding(expressions)
+            expressions = [np.asarray(result[1]) for result in results]
 
-        ann_ids = self.ytvos.getAnnIds(vidIds=[vid_id])
-        if obj_id > len(ann_ids):
-            # ann_ids = [ann_ids[-1]]
+        ann_blobs = self.ann_blobs[vid]
+        if obj_id > len(ann_blobs):
+            # ann_blobs = [ann_blobs[-1]]
             print('--------------------------', filename, obj_id)
-        ann_ids = [ann_ids[obj_id-1]]
 
-        target = self.ytvos.loadAnns(ann_ids)
+        target = [pickle.loads(ann_blobs[obj_id-1])]
         target = {'image_id': idx, 'video_id': vid, 'frame_id': frame_id, 'annotations': target}
-        target = self.prepare(img[0], target, inds, self.num_frames)
+        target = self.prepare(image_size, target, inds, self.num_frames)
+        clip_size = T.get_clip_size(clip_frames if clip_frames is not None else img)
+        if clip_size != image_size:
+            target = T.resize_target(target, image_size, clip_size)
+        img, target = self._apply_transforms(img, target, clip_frames)
+        return img, expressions, target, (img_clip, text_clip)
+
+    def _apply_transforms(self, img, target, clip_frames=None):
+        if self.tensor_transforms:
+            img = clip_frames if clip_frames is not None else T.stack_clip(img)
         if self._transforms is not None:
             img, target = self._transforms(img, target)
-        
-        return torch.cat(img,dim=0), expressions, target, (img_clip, text_clip)
+        img = img.flatten(0, 1) if isinstance(img, torch.Tensor) else torch.cat(img, dim=0)
+        return img, target
+
+    def _load_frame(self, file_name, path, reduction=1):
+        if self.frame_cache is None:
+            return decode_frame(path, reduction)
+        return self.frame_cache.load(file_name, path, reduction)
+
+
+def build_manifest(ann_file, exp_file):
+    ytvos = YTVOS(ann_file)
+    exp_infos = load_expressions(exp_file)
+    vid_infos = ytvos.loadVids(ytvos.getVidIds())
+    ann_blobs = []
+    all_query = []
+    num_frames = np.zeros(len(vid_infos), dtype=np.int64)
+    num_exps = np.zeros(len(vid_infos), dtype=np.int64)
+    for idx, vid_info in enumerate(vid_infos):
+        ann_blobs.append([pickle.dumps(ann, protocol=pickle.HIGHEST_PROTOCOL)
+                          for ann in ytvos.loadAnns(ytvos.getAnnIds(vidIds=[vid_info['id']]))])
+        filename = vid_info['file_names'][0].split('/')[0]
+        exps = exp_infos[filename]['expressions']
+        num_frames[idx] = len(vid_info['file_names'])
+        num_exps[idx] = len(exps)
+        all_query.extend(exp['exp'] for exp in exps)
+
+    # one (video, frame, expression) entry per frame x expression, frame-major within a video
+    counts = num_frames * num_exps
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    exps_per_entry = np.repeat(num_exps, counts)
+    img_ids = np.zeros(len(local), dtype=[('vid', np.int32), ('frame_id', np.int32), ('exp_id', np.int32)])
+    img_ids['vid'] = np.repeat(np.arange(len(vid_infos)), counts)
+    img_ids['frame_id'] = local // exps_per_entry
+    img_ids['exp_id'] = local % exps_per_entry
+    return {
+        'vid_infos': vid_infos,
+        'exp_infos': exp_infos,
+        'ann_blobs': ann_blobs,
+        'img_ids': img_ids,
+        'all_query': string_array(all_query),
+    }
 
 
 def load_expressions(exp_file):
@@ -156,8 +261,8 @@ class ConvertCocoPolysToMask(object):
     def __init__(self, return_masks=False):
         self.return_masks = return_masks
 
-    def __call__(self, image, target, inds, num_frames):
-        w, h = image.size
+    def __call__(self, image_size, target, inds, num_frames):
+        w, h = image_size
         image_id = target["image_id"]
         frame_id = target['frame_id']
         image_id = torch.tensor([image_id])
@@ -217,27 +322,29 @@ class ConvertCocoPolysToMask(object):
         return  target
 
 
-def make_coco_transforms(image_set):
+def make_coco_transforms(image_set, uint8_transport=False):
 
-    normalize = T.Compose([
-        T.ToTensor(),
-        T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
+    if uint8_transport:
+        # normalized in the main process, see util.misc.normalize_nested_tensor
+        normalize = T.ToUint8Tensor()
+    else:
+        normalize = T.Compose([
+            T.ToTensor(),
+            T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
 
     scales = [480, 512, 544, 576, 608, 640, 672, 704, 736, 768]
 
     if image_set == 'train':
         return T.Compose([
             T.RandomHorizontalFlip(),
-            T.RandomResize(scales, max_size=800),
-            T.PhotometricDistort(),
-            T.Compose([
-                     T.RandomResize([400, 500, 600]),
-                     T.RandomSizeCrop(384, 600),
-                     # To suit the GPU memory the scale might be different
-                     T.RandomResize([300], max_size=540),#for r50
-                     #T.RandomResize([280], max_size=504),#for r101
-            ]),
+            # RandomResize(scales, max_size=800) -> RandomResize([400, 500, 600]) ->
+            # RandomSizeCrop(384, 600) -> RandomResize([300], max_size=540), resampled once
+            T.FusedRandomResizeCrop(scales, max_size=800, crop_scales=[400, 500, 600], crop_size=(384, 600),
+                                    # To suit the GPU memory the scale might be different
+                                    final_scales=[300], final_max_size=540),#for r50
+                                    #final_scales=[280], final_max_size=504),#for r101
+            T.ClipPhotometricDistort(per_frame=True),
             normalize,
         ])
 
@@ -263,5 +370,12 @@ def build(image_set, args):
         "val": (root / "valid/JPEGImages", root /  f'ann/{mode}_valid_sub.json'),
     }
     img_folder, mask_folder, ann_file, exp_file, vocab_path = PATHS[image_set]
-    dataset = YTVOSDataset(img_folder, mask_folder, ann_file, exp_file, vocab_path, transforms=make_coco_transforms(image_set), return_masks=args.masks, num_frames = args.num_frames)
+    frame_cache = None
+    if args.frame_cache_mb > 0:
+        frame_cache = SharedFrameCache(args.frame_cache_mb * 2 ** 20, slot_bytes=720 * 1280 * 3)
+    dataset = YTVOSDataset(img_folder, mask_folder, ann_file, exp_file, vocab_path, transforms=make_coco_transforms(image_set, args.uint8_transport), return_masks=args.masks, num_frames = args.num_frames,
+                           bert_store=args.bert_store, clip_store=args.clip_store, frame_cache=frame_cache,
+                           frame_store=args.ytvos_frame_store, manifest_cache_dir=args.manifest_cache_dir,
+                           tensor_transforms=args.tensor_transforms, reduced_decode=args.reduced_decode,
+                           sample_mode=getattr(args, 'sample_mode', 'full'))
     return dataset
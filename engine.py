@@ -14,14 +14,16 @@ import torch
 
 import util.misc as utils
 from datasets.coco_eval import CocoEvaluator
+from datasets.utils import normalize_clip_view
 from datasets.panoptic_eval import PanopticEvaluator
 
 import torchvision.models as models
 import clip
 
 def train_one_epoch(model: torch.nn.Module, criterion: torch.nn.Module,
-                    source_loader: Iterable, target_loader: Iterable, optimizer: torch.optim.Optimizer,
-                    device: torch.device, epoch: int, max_norm: float = 0):
+                    data_loader: Iterable, optimizer: torch.optim.Optimizer,
+                    device: torch.device, epoch: int, max_norm: float = 0,
+                    selector: torch.nn.Module = None, clip_store: bool = False):
     # wenet.evaluate()
     model.train()
     criterion.train()
@@ -32,35 +34,46 @@ def train_one_epoch(model: torch.nn.Module, criterion: torch.nn.Module,
     print_freq = 10
     count = 0
 
-    target_iter = iter(target_loader)
-    num_iter = len(target_loader)
-
-    selector, preprocess = clip.load("RN50", device=device)
+    if selector is None:
+        selector, preprocess = clip.load("RN50", device=device)
 
     accumulation_steps = 4
     mmd_batch = []
     acc_loss = 0
 
-    for samples_s, expressions_s, targets_s, cd_s in metric_logger.log_every(source_loader, print_freq, header):
+    # data_loader yields (source batch, target batch) pairs, see datasets.samplers
+    for (samples_s, expressions_s, targets_s, cd_s), (samples_t, _, _, cd_t) in metric_logger.log_every(
+            data_loader, print_freq, header):
         count += 1
 
-        samples_t, _, _, cd_t = target_iter.next()
-        if count % num_iter == 0:
-            target_iter = iter(target_loader)
-            
         samples_s = samples_s.to(device)
+        if samples_s.tensors.dtype == torch.uint8:
+            samples_s = utils.normalize_nested_tensor(samples_s)
         expressions_s = expressions_s.to(device)
         targets_s = [{k: v.to(device) for k, v in t.items()} for t in targets_s]
         img_clip_s = cd_s[0][0].to(device)
         text_clip_s = cd_s[0][1].to(device)
 
         samples_t = samples_t.to(device)
+        if samples_t.tensors.dtype == torch.uint8:
+            samples_t = utils.normalize_nested_tensor(samples_t)
         img_clip_t = cd_t[0][0].to(device)
 
         with torch.no_grad():
-            video_concept_s = selector.encode_image(img_clip_s).float()   # 36*3*224*224 -> 36*512
-            video_concept_t = selector.encode_image(img_clip_t).float()
-            logits_per_image, logits_per_text = selector(img_clip_t, text_clip_s)
+            if clip_store:
+                # cd holds the precomputed CLIP embeddings of the frames and expressions
+                video_concept_s = img_clip_s.float()
+                video_concept_t = img_clip_t.float()
+                image_features = video_concept_t / video_concept_t.norm(dim=1, keepdim=True)
+                text_features = text_clip_s / text_clip_s.norm(dim=1, keepdim=True)
+                logits_per_text = selector.logit_scale.exp().float() * text_features @ image_features.t()
+            else:
+                # the loaders ship the CLIP views as uint8
+                img_clip_s = normalize_clip_view(img_clip_s)
+                img_clip_t = normalize_clip_view(img_clip_t)
+                video_concept_s = selector.encode_image(img_clip_s).float()   # 36*3*224*224 -> 36*512
+                video_concept_t = selector.encode_image(img_clip_t).float()
+                logits_per_image, logits_per_text = selector(img_clip_t, text_clip_s)
             score_per_text = torch.mean(logits_per_text, dim=1)
             probs = score_per_text.softmax(dim=-1)
             tid = torch.argmax(probs)
@@ -85,7 +98,7 @@ def train_one_epoch(model: torch.nn.Module, criterion: torch.nn.Module,
         rec_feature_s = outputs_s['rec_feature']
         rec_feature_t = outputs_t['rec_feature']
         with torch.no_grad():
-            cand_text = selector.encode_text(text_clip_s)
+            cand_text = text_clip_s if clip_store else selector.encode_text(text_clip_s)
             rec_feature_s = selector.encode_image(rec_feature_s)
             rec_feature_t = selector.encode_image(rec_feature_t)
             outputs_s['rec_feature_s'] = rec_feature_s
@@ -145,6 +158,8 @@ def train_one_epoch(model: torch.nn.Module, criterion: torch.nn.Module,
         # metric_logger.update(class_error=loss_dict_reduced['class_error'])
         metric_logger.update(class_error=0)
         metric_logger.update(lr=optimizer.param_groups[0]["lr"])
+        metric_logger.update(pad_eff_s=utils.padding_efficiency(samples_s),
+                             pad_eff_t=utils.padding_efficiency(samples_t))
 
     # gather the stats from all processes
     print('11111111111111')
@@ -177,6 +192,8 @@ def evaluate(model, criterion, postprocessors, data_loader, base_ds, device, out
 
     for samples, targets in metric_logger.log_every(data_loader, 10, header):
         samples = samples.to(device)
+        if samples.tensors.dtype == torch.uint8:
+            samples = utils.normalize_nested_tensor(samples)
         targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
 
         outputs = model(samples)
@@ -28,6 +28,10 @@ from scipy.optimize import linear_sum_assignment
 import pycocotools.mask as mask_util
 
 from util.misc import nested_tensor_from_exp
+from datasets.feature_store import FeatureStore
+from datasets.frame_store import FrameStore
+from datasets.gt_store import A2DGroundTruthStore
+from datasets.data_prefetcher import DataPrefetcher
 
 import yaml
 
@@ -117,6 +121,16 @@ def get_args_parser():
     parser.add_argument('--coco_path', type=str)
     parser.add_argument('--coco_panoptic_path', type=str)
     parser.add_argument('--remove_difficult', action='store_true')
+    parser.add_argument('--bert_store', default='',
+                        help="Path to precomputed BERT expression features (prepare_data.py bert)")
+    parser.add_argument('--frame_store', default='',
+                        help="Path to the packed A2D frames (prepare_data.py frames)")
+    parser.add_argument('--prefetch_depth', default=2, type=int,
+                        help="Samples loaded and moved to the device ahead of the model, 0 to load them synchronously")
+    parser.add_argument('--target_frame_only', action='store_true',
+                        help="Return the mask of the annotated frame only; all frames are still decoded")
+    parser.add_argument('--gt_store', default='',
+                        help="Path to the consolidated A2D ground truth (prepare_data.py a2d_gt)")
 
     parser.add_argument('--output_dir', default='output_ytvos',
                         help='path where to save, empty for no saving')
@@ -214,7 +228,10 @@ def main(args):
         # import pickle
         # with open('cnt.pkl', 'rb') as fp:
         #     id2idx = pickle.load(fp)
-        bert_embedding = BertEmbedding()
+        bert_store = FeatureStore(args.bert_store) if args.bert_store else None
+        bert_embedding = BertEmbedding() if bert_store is None else None
+        frame_store = FrameStore(args.frame_store) if args.frame_store else None
+        gt_store = A2DGroundTruthStore(args.gt_store) if args.gt_store else None
         selector, preprocess = clip.load("RN50", device=device)
         test_videos = {}
         with open(paths['videoset_path'], newline='') as fp:
@@ -250,15 +267,18 @@ def main(args):
         
         iou = 0
         print('test:', len(test_samples))
-        for i in range(len(test_samples)):
-            video_id, instance_id, frame_idx, query = test_samples[i]
+        def load_sample(sample):
+            video_id, instance_id, frame_idx, query = sample
             query = query.lower()
             frame_idx = int(frame_idx)
             h5_path = os.path.join('../lzj/data/a2d/a2d_annotation_with_instances', video_id, '%05d.h5' % (frame_idx + 1))
             if not os.path.exists(h5_path):
                 h5_path = os.path.join('../lzj/data/a2d/a2d_annotation_with_instances', video_id, '%05d.h5' % (24 + 1))
             frame_path = os.path.join('../lzj/data/a2d/Release/pngs320H', video_id)
-            frames = list(map(lambda x: os.path.join(frame_path, x), sorted(os.listdir(frame_path))))   
+            if frame_store is not None:
+                frames = [os.path.join(frame_path, x) for x in frame_store.names(video_id)]
+            else:
+                frames = list(map(lambda x: os.path.join(frame_path, x), sorted(os.listdir(frame_path))))   
             assert len(frames) == test_videos[video_id]['num_frames']
             all_frames = []
             mid_frame = (args.num_frames-1)//2
@@ -269,39 +289,62 @@ def main(args):
                     all_frames[j] = 0
                 elif all_frames[j] >= len(frames):
                     all_frames[j] = len(frames) - 1
+            frame_ids = all_frames
             all_frames = np.asarray(frames)[all_frames]
             img_set = []
-            for j in all_frames:
-                im = Image.open(j)
-                img_set.append(transform(im).unsqueeze(0).cuda())
+            if frame_store is not None:
+                for frame in frame_store.frames(video_id, frame_ids):
+                    img_set.append(transform(Image.fromarray(frame)).unsqueeze(0))
+                out_size = frame_store.orig_size(video_id)
+            else:
+                for j in all_frames:
+                    im = Image.open(j)
+                    img_set.append(transform(im).unsqueeze(0))
+                out_size = im.size
             img=torch.cat(img_set,0)
 
-            exp = bert_embedding([query])
-            exp = np.asarray(exp[0][1])
-            exp = nested_tensor_from_exp([exp]).to(device)
+            if bert_store is not None:
+                exp = bert_store[query]
+            else:
+                exp = bert_embedding([query])
+                exp = np.asarray(exp[0][1])
+            exp = nested_tensor_from_exp([exp])
             exp = exp.tensors
 
-            outputs = model(img, exp)
-            masks = outputs['pred_masks'][0][mid_frame]
-            pred_masks =F.interpolate(masks.reshape(1,num_ins,masks.shape[-2],masks.shape[-1]),(im.size[1],im.size[0]),mode="bilinear").sigmoid().cpu().detach().numpy()>0.5
-
-            with h5py.File(h5_path, mode='r') as fp:
-                instance = np.asarray(fp['instance'])
-                all_masks = np.asarray(fp['reMask'])
-                if len(all_masks.shape) == 3 and instance.shape[0] != all_masks.shape[0]:
-                    print(video_id, frame_idx + 1, instance.shape, all_masks.shape)
-                assert len(all_masks.shape) == 2 or len(all_masks.shape) == 3
-                if len(all_masks.shape) == 2:
-                    mask = all_masks[np.newaxis]
-                else:
-                    instance_id = int(instance_id)
-                    idx = np.where(instance == instance_id)[0][0]
-                    mask = all_masks[idx]
-                    mask = mask[np.newaxis]
-                assert len(mask.shape) == 3
-                assert mask.shape[0] > 0
-                fine_gt_mask = np.transpose(np.asarray(mask), (0, 2, 1))[0]
-            
+            if gt_store is not None:
+                gt_frame = frame_idx if gt_store.has_frame(video_id, frame_idx) else 24
+                fine_gt_mask = gt_store.get(video_id, gt_frame, instance_id)[0]
+            else:
+                with h5py.File(h5_path, mode='r') as fp:
+                    instance = np.asarray(fp['instance'])
+                    all_masks = np.asarray(fp['reMask'])
+                    if len(all_masks.shape) == 3 and instance.shape[0] != all_masks.shape[0]:
+                        print(video_id, frame_idx + 1, instance.shape, all_masks.shape)
+                    assert len(all_masks.shape) == 2 or len(all_masks.shape) == 3
+                    if len(all_masks.shape) == 2:
+                        mask = all_masks[np.newaxis]
+                    else:
+                        instance_id = int(instance_id)
+                        idx = np.where(instance == instance_id)[0][0]
+                        mask = all_masks[idx]
+                        mask = mask[np.newaxis]
+                    assert len(mask.shape) == 3
+                    assert mask.shape[0] > 0
+                    fine_gt_mask = np.transpose(np.asarray(mask), (0, 2, 1))[0]
+            return img, exp, out_size, mid_frame, fine_gt_mask
+
+        # the next samples are loaded and copied to the device while the model runs
+        prefetcher = DataPrefetcher((load_sample(sample) for sample in test_samples), device,
+                                    depth=args.prefetch_depth)
+        for img, exp, out_size, mid_frame, fine_gt_mask in prefetcher:
+            if args.target_frame_only:
+                outputs = model(img, exp, frames=[mid_frame], inference=True)
+                masks = outputs['pred_masks'][0][0]
+            else:
+                outputs = model(img, exp, inference=True)
+                masks = outputs['pred_masks'][0][mid_frame]
+            pred_masks =F.interpolate(masks.reshape(1,num_ins,masks.shape[-2],masks.shape[-1]),(out_size[1],out_size[0]),mode="bilinear").sigmoid().cpu().detach().numpy()>0.5
+
             I, U = computeIoU(pred_masks[0][0], fine_gt_mask)
             if U == 0:
                 this_iou = 0.0
@@ -16,8 +16,11 @@ from torch.utils.data import DataLoader, DistributedSampler
 import datasets
 import util.misc as utils
 from datasets import build_dataset, get_coco_api_from_dataset
+from datasets.data_prefetcher import DataPrefetcher, normalize_uint8_samples
+from datasets.samplers import PairedBatchSampler, PairedCollator, PairedDataset, ShapeBucketSampler, VideoAffinitySampler
 from engine import evaluate, train_one_epoch
 from models import build_model
+import clip
 
 
 def get_args_parser():
@@ -87,6 +90,37 @@ def get_args_parser():
     parser.add_argument('--dataset_file', default='ytvos')
     parser.add_argument('--ytvos_path', type=str)
     parser.add_argument('--remove_difficult', action='store_true')
+    parser.add_argument('--bert_store', default='',
+                        help="Path to precomputed BERT expression features (prepare_data.py bert)")
+    parser.add_argument('--clip_store', default='',
+                        help="Path to precomputed frozen CLIP embeddings (prepare_data.py clip)")
+    parser.add_argument('--frame_cache_mb', default=0, type=int,
+                        help="Size of the decoded frame cache shared by the data loader workers, per dataset")
+    parser.add_argument('--ytvos_frame_store', default='',
+                        help="Path to the packed Ref-YTVOS frames (prepare_data.py frames)")
+    parser.add_argument('--a2d_frame_store', default='',
+                        help="Path to the packed A2D frames (prepare_data.py frames)")
+    parser.add_argument('--a2d_gt_store', default='',
+                        help="Path to the consolidated A2D ground truth (prepare_data.py a2d_gt)")
+    parser.add_argument('--manifest_cache_dir', default='',
+                        help="Directory caching the parsed dataset annotations, empty to parse them on every run")
+    parser.add_argument('--tensor_transforms', action='store_true',
+                        help="Run the data augmentation on one stacked uint8 tensor per clip instead of PIL frames; "
+                             "before torch 1.11, which cannot antialias, shrunk frames differ from the PIL ones")
+    parser.add_argument('--reduced_decode', action='store_true',
+                        help="Decode the Ref-YTVOS JPEGs at the lowest power-of-two scale the augmentation still needs")
+    parser.add_argument('--uint8_transport', action='store_true',
+                        help="Ship the clips from the loader workers as uint8 and normalize them on the device")
+    parser.add_argument('--target_sample_mode', default='frames', choices=['full', 'frames'],
+                        help="'frames' loads only the frames and CLIP views of the target domain, which is all training uses")
+    parser.add_argument('--prefetch_depth', default=2, type=int,
+                        help="Batches moved to the device ahead of the training step, 0 to copy them synchronously")
+    parser.add_argument('--video_affinity', action='store_true',
+                        help="Give every rank whole videos, so its frame cache and stores are hit repeatedly")
+    parser.add_argument('--affinity_window', default=64, type=int,
+                        help="Samples shuffled together within a rank's shard with --video_affinity")
+    parser.add_argument('--shape_buckets', action='store_true',
+                        help="Batch clips whose augmented sizes are close, to cut the padding of batch_size > 1")
 
     parser.add_argument('--output_dir', default='output',
                         help='path where to save, empty for no saving')
@@ -141,30 +175,37 @@ def main(args):
     lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, args.lr_drop)
 
     # no validation ground truth for ytvos dataset
+    args.sample_mode = 'full'
     dataset_source = build_dataset(image_set='train', args=args)
-    if args.distributed:
+    if args.video_affinity:
+        sampler_source = VideoAffinitySampler(dataset_source.sample_videos(), window=args.affinity_window, seed=args.seed)
+    elif args.distributed:
         sampler_source = DistributedSampler(dataset_source)
     else:
         sampler_source = torch.utils.data.RandomSampler(dataset_source)
-
-    batch_sampler_source = torch.utils.data.BatchSampler(
-        sampler_source, args.batch_size, drop_last=True)
-
-    data_loader_source = DataLoader(dataset_source, batch_sampler=batch_sampler_source,
-                                   collate_fn=utils.collate_fn, num_workers=args.num_workers)
+    if args.shape_buckets:
+        sampler_source = ShapeBucketSampler(sampler_source, dataset_source.sample_sizes(), dataset_source._transforms, args.batch_size)
 
     args.dataset_file = 'a2d'
+    args.sample_mode = args.target_sample_mode
     dataset_target = build_dataset(image_set='train', args=args)
-    if args.distributed:
+    if args.video_affinity:
+        sampler_target = VideoAffinitySampler(dataset_target.sample_videos(), window=args.affinity_window, seed=args.seed)
+    elif args.distributed:
         sampler_target = DistributedSampler(dataset_target)
     else:
         sampler_target = torch.utils.data.RandomSampler(dataset_target)
-
-    batch_sampler_target = torch.utils.data.BatchSampler(
-        sampler_target, args.batch_size, drop_last=True)
-
-    data_loader_target = DataLoader(dataset_target, batch_sampler=batch_sampler_target,
-                                   collate_fn=utils.collate_fn, num_workers=args.num_workers)
+    if args.shape_buckets:
+        sampler_target = ShapeBucketSampler(sampler_target, dataset_target.sample_sizes(), dataset_target._transforms, args.batch_size)
+
+    # one loader, and one worker pool, for both domains; the target domain is cycled endlessly
+    dataset_train = PairedDataset(dataset_source, dataset_target)
+    # the batches queued by DataPrefetcher, the one it prepares, the one in use and the one being collated
+    num_slots = max(4, args.prefetch_depth + 3)
+    batch_sampler_train = PairedBatchSampler(sampler_source, sampler_target, args.batch_size, drop_last=True)
+    data_loader_train = DataLoader(dataset_train, batch_sampler=batch_sampler_train,
+                                   collate_fn=PairedCollator(utils.Collator(num_slots), utils.Collator(num_slots)),
+                                   num_workers=args.num_workers, pin_memory=device.type == 'cuda')
 
     output_dir = Path(args.output_dir)
     
@@ -187,18 +228,26 @@ def main(args):
             lr_scheduler.load_state_dict(checkpoint['lr_scheduler'])
             args.start_epoch = checkpoint['epoch'] + 1
 
+    # frozen CLIP model used for the domain adaptation losses
+    selector, _ = clip.load("RN50", device=device)
+
     print("Start training")
     start_time = time.time()
     print(args.start_epoch, args.epochs)
     
     for epoch in range(args.start_epoch, args.epochs):
         torch.cuda.empty_cache()
-        if args.distributed:
-            sampler_source.set_epoch(epoch)
+        if args.distributed or args.video_affinity or args.shape_buckets:
+            batch_sampler_train.set_epoch(epoch)
         print('666666666666666666666666')
         train_stats = train_one_epoch(
-            model, criterion, data_loader_source, data_loader_target, optimizer, device, epoch,
-            args.clip_max_norm)
+            model, criterion,
+            DataPrefetcher(data_loader_train, device, prepare=normalize_uint8_samples, depth=args.prefetch_depth),
+            optimizer, device, epoch,
+            args.clip_max_norm, selector=selector, clip_store=bool(args.clip_store))
+        for name, dataset in (('source', dataset_source), ('target', dataset_target)):
+            if dataset.frame_cache is not None:
+                print('{} frame cache: {}'.format(name, dataset.frame_cache.stats()))
         lr_scheduler.step()
         if args.output_dir:
             checkpoint_paths = [output_dir / 'checkpoint.pth']
@@ -51,12 +51,13 @@ class MultTransformerEncoder(nn.Module):
         if self.normalize:
             self.layer_norm = LayerNorm(embed_dim)
 
-    def forward(self, x_in, x_in_k = None, x_in_v = None, pos = None, mask = None, exp_mask = None):
+    def forward(self, x_in, x_in_k = None, x_in_v = None, pos = None, mask = None, exp_mask = None, inference = False):
         """
         Args:
             x_in (FloatTensor): embedded input of shape `(src_len, batch, embed_dim)`
             x_in_k (FloatTensor): embedded input of shape `(src_len, batch, embed_dim)`
             x_in_v (FloatTensor): embedded input of shape `(src_len, batch, embed_dim)`
+            inference (bool): keep no per-layer outputs, the fusion returned is None
         Returns:
             dict:
                 - **encoder_out** (Tensor): the last encoder layer's output of
@@ -92,13 +93,14 @@ class MultTransformerEncoder(nn.Module):
                 x, fus = layer(x, x_k, x_v, mask, exp_mask)
             else:
                 x, fus = layer(x, mask, exp_mask)
-            intermediates.append(x)
-            fusions.append(fus)
+            if not inference:
+                intermediates.append(x)
+                fusions.append(fus)
 
         if self.normalize:
             x = self.layer_norm(x)
 
-        return x, fusions[0]
+        return x, fusions[0] if fusions else None
 
     def max_positions(self):
         """Maximum input length supported by the encoder."""
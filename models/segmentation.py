@@ -86,7 +86,18 @@ class CVMNsegm(nn.Module):
                                 nn.ReLU(),
                                 nn.Conv3d(12,1,1))
 
-    def forward(self, samples: NestedTensor, expressions, selector=None, is_source=True, alpha=0):
+    def forward(self, samples: NestedTensor, expressions, selector=None, is_source=True, alpha=0, frames=None,
+                inference=False):
+        """With inference, only pred_boxes and pred_masks are computed: none of the outputs
+        the training losses need (memory_h, memory, fusion, aux_outputs, rec_feature)
+        is, and only the last decoder layer's output is kept.
+
+        frames, a list of frame indices, only with inference, selects the frames whose
+        masks are returned. The masks of all frames are still decoded, as the
+        GroupNorms of insmask_head normalize over every frame; it saves little compute.
+        """
+        if frames is not None and not inference:
+            raise ValueError('frames is only supported with inference')
         if not isinstance(samples, NestedTensor):
             samples = nested_tensor_from_tensor_list(samples)
         # if not isinstance(expressions, NestedTensor):
@@ -106,61 +117,66 @@ class CVMNsegm(nn.Module):
         exp = self.cvmn.proj_t(expressions.transpose(1, 2))
         out = {}
         
-        hs, memory, fusion = self.cvmn.transformer(src_proj, mask, exp, self.cvmn.query_embed.weight, pos, [])
-
-        # hallucinator
-        memory_h = memory.mean(-1).transpose(1, 2)
-        memory_h = self.cvmn.hallucinator(memory_h)
+        hs, memory, fusion = self.cvmn.transformer(src_proj, mask, exp, self.cvmn.query_embed.weight, pos, [],
+                                                   inference=inference)
 
         outputs_coord = self.cvmn.bbox_embed(hs).sigmoid()
         # out = {"pred_logits": outputs_class[-1], "pred_boxes": outputs_coord[-1]}
         out["pred_boxes"] = outputs_coord[-1]
-        out['memory'] = fusion[0]  # 3600*1*384
-        out['fusion'] = fusion[1]
-        out['memory_h'] = memory_h
-        if self.cvmn.aux_loss:
-            out['aux_outputs'] = [{'pred_boxes': a} for a in outputs_coord[:-1]]
-        for i in range(3):
-            _,c_f,h,w = features[i].tensors.shape
-            features[i].tensors = features[i].tensors.reshape(bs_f, self.cvmn.num_frames, c_f, h,w)
-        n_f = self.cvmn.num_queries//self.cvmn.num_frames
+        if not inference:
+            # hallucinator
+            memory_h = memory.mean(-1).transpose(1, 2)
+            memory_h = self.cvmn.hallucinator(memory_h)
+            out['memory'] = fusion[0]  # 3600*1*384
+            out['fusion'] = fusion[1]
+            out['memory_h'] = memory_h
+            if self.cvmn.aux_loss:
+                out['aux_outputs'] = [{'pred_boxes': a} for a in outputs_coord[:-1]]
+        num_frames = self.cvmn.num_frames
+        n_f = self.cvmn.num_queries//num_frames
         if n_f == 0:
             n_f = 1
-        outputs_seg_masks = []
-        
-        # image level processing using box attention
-        for i in range(self.cvmn.num_frames):
-            hs_f = hs[-1][:,i*n_f:(i+1)*n_f,:]
-            memory_f = memory[:,:,i,:].reshape(bs_f, c, s_h,s_w)
-            mask_f = mask[:,i,:].reshape(bs_f, s_h,s_w)
-            bbox_mask_f = self.bbox_attention(hs_f, memory_f, mask=mask_f)
-            seg_masks_f = self.mask_head(memory_f, bbox_mask_f, [features[2].tensors[:,i], features[1].tensors[:,i], features[0].tensors[:,i]])
-            outputs_seg_masks_f = seg_masks_f.view(bs_f, n_f, 24, seg_masks_f.shape[-2], seg_masks_f.shape[-1])
-            outputs_seg_masks.append(outputs_seg_masks_f)
-        frame_masks = torch.cat(outputs_seg_masks,dim=0)
-        outputs_seg_masks = []
-
-        # instance level processing using 3D convolution
-        for i in range(frame_masks.size(1)):
-            mask_ins = frame_masks[:,i].unsqueeze(0)
-            mask_ins = mask_ins.permute(0,2,1,3,4)
-            outputs_seg_masks.append(self.insmask_head(mask_ins))
-        outputs_seg_masks = torch.cat(outputs_seg_masks,1).squeeze(0).permute(1,0,2,3)  # 36*10*75*101
-        # outputs_seg_masks = outputs_seg_masks.reshape(1,360,outputs_seg_masks.size(-2),outputs_seg_masks.size(-1))  # 1*360*75*101
-        # outputs_seg_masks = outputs_seg_masks.reshape(bs_f,36,outputs_seg_masks.size(-2),outputs_seg_masks.size(-1))
-        outputs_seg_masks = outputs_seg_masks.reshape(bs_f,self.cvmn.num_frames,outputs_seg_masks.size(-2),outputs_seg_masks.size(-1))
-        # outputs_seg_masks = outputs_seg_masks.reshape(bs_f,1,outputs_seg_masks.size(-2),outputs_seg_masks.size(-1))
-        out["pred_masks"] = outputs_seg_masks
 
+        # image level processing using box attention, for all frames in one call: the frames are
+        # folded into the batch frame-major, i.e. frame i of clip b is at i*bs_f+b
+        hs_f = hs[-1][:,:num_frames*n_f].reshape(bs_f, num_frames, n_f, c).transpose(0,1).flatten(0,1)
+        memory_f = memory.permute(2,0,1,3).reshape(num_frames*bs_f, c, s_h, s_w)
+        mask_f = mask.transpose(0,1).reshape(num_frames*bs_f, s_h, s_w)
+        fpns = []
+        for i in (2, 1, 0):
+            _,c_f,h,w = features[i].tensors.shape
+            fpns.append(features[i].tensors.reshape(bs_f, num_frames, c_f, h, w).transpose(0,1).flatten(0,1))
+        bbox_mask_f = self.bbox_attention(hs_f, memory_f, mask=mask_f)
+        seg_masks_f = self.mask_head(memory_f, bbox_mask_f, fpns)
+        frame_masks = seg_masks_f.view(num_frames*bs_f, n_f, 24, seg_masks_f.shape[-2], seg_masks_f.shape[-1])
+
+        # instance level processing using 3D convolution, for all instances and clips in one call:
+        # every (clip, instance) pair is one sample of the Conv3d batch, with its frames as depth
+        _,_,c_m,m_h,m_w = frame_masks.shape
+        mask_ins = frame_masks.view(num_frames, bs_f, n_f, c_m, m_h, m_w).permute(1,2,3,0,4,5).flatten(0,1)
+        if frames is None:
+            outputs_seg_masks = self.insmask_head(mask_ins)  # (bs_f*n_f)*1*36*75*101
+            num_out = num_frames
+        else:
+            # the last convolution is 1x1x1, the only part that can be restricted to the requested frames
+            outputs_seg_masks = self.insmask_head[:-1](mask_ins)[:,:,frames]
+            outputs_seg_masks = self.insmask_head[-1](outputs_seg_masks)
+            num_out = len(frames)
+        # frame-major queries, as in hs
+        outputs_seg_masks = outputs_seg_masks.view(bs_f, n_f, num_out, m_h, m_w).transpose(1,2)
+        outputs_seg_masks = outputs_seg_masks.reshape(bs_f, num_out*n_f, m_h, m_w)
+        out["pred_masks"] = outputs_seg_masks
+        if inference:
+            return out
 
+        # the masked frames for the reconstruction loss, at the CLIP input size: the frames are resized,
+        # the masks upsampled straight to the same size, and both center-cropped before being multiplied
         visual_feature = samples.tensors
+        visual_feature = T.Resize(size=224)(visual_feature)
         seg_mask = F.interpolate(outputs_seg_masks, size=visual_feature.shape[-2:], mode='bilinear')
         seg_mask = seg_mask.transpose(0,1)
-        out["pred_interp"] = seg_mask
-        visual_feature = torch.mul(visual_feature, seg_mask)
-        process = T.Compose([T.Resize(size=224), T.CenterCrop(size=(224,224))])
-        visual_feature1 = process(visual_feature)
-        out["rec_feature"] = visual_feature1
+        crop = T.CenterCrop(size=(224,224))
+        out["rec_feature"] = torch.mul(crop(visual_feature), crop(seg_mask))
 
         return out
 
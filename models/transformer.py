@@ -56,7 +56,8 @@ class Transformer(nn.Module):
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
 
-    def forward(self, src, mask, exp, query_embed, pos_embed, exp_mask):
+    def forward(self, src, mask, exp, query_embed, pos_embed, exp_mask, inference=False):
+        # inference: only the output of the last decoder layer is returned, and no fusion
         # flatten NxCxHxW to HWxNxC
         bs, c, h, w = src.shape   # 1*384*36*150
         src = src.flatten(2).permute(2, 0, 1)   # 5400 * 1 * 384   l*bs*dim
@@ -69,10 +70,10 @@ class Transformer(nn.Module):
 
         tgt = torch.zeros_like(query_embed)   # 36 * 1 * 384
         # memory = self.encoder(src, src_key_padding_mask=mask, pos=pos_embed)   # 5400 * 1 * 384
-        memory, fusion = self.encoder(src, exp, exp, pos_embed, mask, exp_mask)
+        memory, fusion = self.encoder(src, exp, exp, pos_embed, mask, exp_mask, inference=inference)
         # memory = self.encoder(src, src, src)
         hs = self.decoder(tgt, memory, memory_key_padding_mask=mask,   # 6 * 360 * 1 * 384
-                          pos=pos_embed, query_pos=query_embed)
+                          pos=pos_embed, query_pos=query_embed, keep_intermediate=not inference)
         return hs.transpose(1, 2), memory.permute(1, 2, 0).view(bs, c, h, w), (memory, fusion)
 
 
@@ -115,8 +116,10 @@ class TransformerDecoder(nn.Module):
                 tgt_key_padding_mask: Optional[Tensor] = None,
                 memory_key_padding_mask: Optional[Tensor] = None,
                 pos: Optional[Tensor] = None,
-                query_pos: Optional[Tensor] = None):
+                query_pos: Optional[Tensor] = None,
+                keep_intermediate: bool = True):
         output = tgt
+        return_intermediate = self.return_intermediate and keep_intermediate
 
         intermediate = []
 
@@ -126,19 +129,19 @@ class TransformerDecoder(nn.Module):
                            tgt_key_padding_mask=tgt_key_padding_mask,
                            memory_key_padding_mask=memory_key_padding_mask,
                            pos=pos, query_pos=query_pos)
-            if self.return_intermediate:
+            if return_intermediate:
                 intermediate.append(self.norm(output))
 
         if self.norm is not None:
             output = self.norm(output)
-            if self.return_intermediate:
+            if return_intermediate:
                 intermediate.pop()
                 intermediate.append(output)
 
-        if self.return_intermediate:
+        if return_intermediate:
             return torch.stack(intermediate)
 
-        return output
+        return output.unsqueeze(0)
 
 
 class TransformerEncoderLayer(nn.Module):
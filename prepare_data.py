@@ -0,0 +1,105 @@
+"""
+Offline preprocessing for CVMN training and inference.
+
+    python prepare_data.py bert --ytvos_path data/rvos --output data/cache/bert
+    python prepare_data.py clip --ytvos_path data/rvos --output data/cache/clip
+    python prepare_data.py frames --frame_root data/a2d/Release/pngs320H --output data/cache/a2d_frames
+    python prepare_data.py a2d_gt --output data/cache/a2d_gt.h5
+"""
+import argparse
+import csv
+import json
+import os
+from pathlib import Path
+
+from datasets.feature_store import build_bert_store, build_clip_store, clip_frame_key
+from datasets.frame_store import pack_frames
+from datasets.gt_store import convert_a2d_gt
+
+
+A2D_PATHS = {
+    "videoset_path": "data/a2d/Release/videoset.csv",
+    "annotation_path": "data/a2d/Release/Annotations",
+    "sample_path": "data/a2d/a2d_annotation_info.txt",
+}
+A2D_FRAME_PATH = "data/a2d/Release/pngs320H"
+A2D_GT_PATH = "data/a2d/a2d_annotation_with_instances"
+
+
+def a2d_expressions(sample_path=A2D_PATHS['sample_path']):
+    with open(sample_path, newline='') as fp:
+        return [row['query'].lower() for row in csv.DictReader(fp)]
+
+
+def ytvos_expressions(ytvos_path):
+    exp_file = Path(ytvos_path) / "meta_expressions/train/meta_expressions.json"
+    with open(exp_file) as f:
+        videos = json.load(f)['videos']
+    return [exp['exp'] for v in videos.values() for exp in v['expressions'].values()]
+
+
+def list_frames(frame_root, dataset):
+    frames = []
+    for video in sorted(os.listdir(frame_root)):
+        video_path = os.path.join(frame_root, video)
+        for name in sorted(os.listdir(video_path)):
+            path = os.path.join(video_path, name)
+            frames.append((clip_frame_key(dataset, path), path))
+    return frames
+
+
+def prepare_bert(args):
+    expressions = a2d_expressions() + ytvos_expressions(args.ytvos_path)
+    build_bert_store(expressions, args.output, batch_size=args.batch_size)
+
+
+def prepare_clip(args):
+    frames = list_frames(A2D_FRAME_PATH, 'a2d') + \
+        list_frames(os.path.join(args.ytvos_path, 'train/JPEGImages'), 'ytvos')
+    expressions = a2d_expressions() + ytvos_expressions(args.ytvos_path)
+    build_clip_store(frames, expressions, args.output, device=args.device, batch_size=args.batch_size)
+
+
+def prepare_frames(args):
+    pack_frames(args.frame_root, args.output, short_side=args.short_side)
+
+
+def prepare_a2d_gt(args):
+    convert_a2d_gt(args.annotation_root, args.output)
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser('CVMN data preparation')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bert = subparsers.add_parser('bert', help='precompute BERT token features of every expression')
+    bert.add_argument('--ytvos_path', type=str, required=True)
+    bert.add_argument('--output', default='data/cache/bert')
+    bert.add_argument('--batch_size', default=256, type=int)
+    bert.set_defaults(func=prepare_bert)
+
+    clip = subparsers.add_parser('clip', help='precompute frozen CLIP frame and expression embeddings')
+    clip.add_argument('--ytvos_path', type=str, required=True)
+    clip.add_argument('--output', default='data/cache/clip')
+    clip.add_argument('--device', default='cuda')
+    clip.add_argument('--batch_size', default=256, type=int)
+    clip.set_defaults(func=prepare_clip)
+
+    frames = subparsers.add_parser('frames', help='pack the frames of every video into one uint8 array')
+    frames.add_argument('--frame_root', type=str, required=True,
+                        help='directory with one sub-directory of frames per video')
+    frames.add_argument('--output', type=str, required=True)
+    frames.add_argument('--short_side', default=None, type=int,
+                        help='resize the frames to this short side while packing')
+    frames.set_defaults(func=prepare_frames)
+
+    a2d_gt = subparsers.add_parser('a2d_gt', help='convert the A2D h5 annotations into one indexed file')
+    a2d_gt.add_argument('--annotation_root', default=A2D_GT_PATH)
+    a2d_gt.add_argument('--output', default='data/cache/a2d_gt.h5')
+    a2d_gt.set_defaults(func=prepare_a2d_gt)
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_args_parser().parse_args()
+    args.func(args)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import datasets.transforms as T
+from datasets.utils import CLIP_STD, clip_view, normalize_clip_view
+
+clip = pytest.importorskip('clip')
+
+
+def frame(width, height, seed=0):
+    # smooth content with some high frequencies, where a non-antialiased resize would alias
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[:height, :width]
+    image = np.stack([128 + 100 * np.sin(x / 7.), 128 + 100 * np.cos(y / 5.), 128 + 100 * np.sin((x + y) / 3.)], -1)
+    image += rng.uniform(-20, 20, image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def assert_close_to_clip_preprocess(view, image):
+    # the preprocess returned by clip.load, without loading the weights
+    expected = clip.clip._transform(224)(image)
+    assert view.shape == expected.shape
+    # differences in grey levels
+    diff = (view - expected).abs() * torch.as_tensor(CLIP_STD).view(3, 1, 1) * 255
+    assert diff.mean() < 0.5
+    assert diff.max() <= 4
+
+
+@pytest.mark.parametrize('size', [(320, 240), (720, 405), (540, 960)])
+def test_clip_view_matches_clip_preprocess(size):
+    image = frame(*size)
+    assert_close_to_clip_preprocess(normalize_clip_view(clip_view([image]))[0], image)
+    stacked = T.stack_clip([image, image])
+    views = normalize_clip_view(clip_view(stacked))
+    assert views.shape[0] == 2
+    assert_close_to_clip_preprocess(views[1], image)
@@ -0,0 +1,21 @@
+import time
+
+import torch
+
+from datasets.data_prefetcher import DataPrefetcher
+from util.misc import CollateBuffers
+
+
+def test_collate_buffers_are_not_overwritten_while_in_use():
+    depth = 3
+    buffers = CollateBuffers(num_slots=depth + 3, pin_memory=False)
+
+    def loader():
+        for i in range(20):
+            buffers.next_slot()
+            yield buffers.get('images', (2, 3), torch.float32).fill_(i)
+
+    for i, batch in enumerate(DataPrefetcher(loader(), 'cpu', depth=depth)):
+        # let the producer run ahead as far as it can
+        time.sleep(0.01)
+        assert (batch == i).all()
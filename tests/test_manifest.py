@@ -0,0 +1,35 @@
+import os
+
+from datasets.manifest import load_manifest, source_signature
+
+
+def test_listing_a_video_folder_invalidates_the_manifest(tmp_path):
+    video = tmp_path / 'col' / 'video'
+    video.mkdir(parents=True)
+    (video / '00001.png').write_bytes(b'')
+    sources = [tmp_path / 'col', video]
+    before = source_signature(sources)
+    col_mtime = os.stat(tmp_path / 'col').st_mtime_ns
+
+    (video / '00002.png').write_bytes(b'')
+    # adding a frame leaves the parent untouched, only the video folder tells
+    assert os.stat(tmp_path / 'col').st_mtime_ns == col_mtime
+    # on filesystems with coarse timestamps the new mtime may equal the old one
+    os.utime(video, ns=(col_mtime + 10 ** 9, col_mtime + 10 ** 9))
+    assert source_signature(sources) != before
+
+
+def test_cached_manifest_is_reused_until_a_source_changes(tmp_path):
+    source = tmp_path / 'samples.csv'
+    source.write_text('a')
+    calls = []
+
+    def build():
+        calls.append(1)
+        return {'n': len(calls)}
+
+    cache = tmp_path / 'cache'
+    assert load_manifest(cache, 'a2d', [source], build) == {'n': 1}
+    assert load_manifest(cache, 'a2d', [source], build) == {'n': 1}
+    source.write_text('ab')
+    assert load_manifest(cache, 'a2d', [source], build) == {'n': 2}
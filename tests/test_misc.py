@@ -0,0 +1,31 @@
+import torch
+
+from util.misc import nested_tensor_from_tensor_list
+
+
+def test_masks_with_different_instance_counts():
+    one = torch.ones(1, 4, 5)
+    three = torch.full((3, 6, 3), 2.)
+    nested = nested_tensor_from_tensor_list([one, three], split=False)
+    tensors, mask = nested.decompose()
+    assert tensors.shape == (2, 3, 6, 5)
+    assert torch.equal(tensors[0, :1, :4, :5], one)
+    # the missing instance channels and the spatial padding are zero
+    assert tensors[0, 1:].abs().sum() == 0
+    assert tensors[0, :1, 4:].abs().sum() == 0
+    assert torch.equal(tensors[1, :, :6, :3], three)
+    assert tensors[1, :, :, 3:].abs().sum() == 0
+    assert not mask[0, :4, :5].any() and mask[0, 4:].all() and mask[0, :, 5:].all()
+    assert not mask[1, :, :3].any() and mask[1, :, 3:].all()
+
+
+def test_clips_with_different_sizes():
+    a = torch.rand(6, 4, 5)
+    b = torch.rand(6, 3, 7)
+    tensors, mask = nested_tensor_from_tensor_list([a, b]).decompose()
+    assert tensors.shape == (4, 3, 4, 7)
+    assert torch.equal(tensors[:2, :, :4, :5], a.view(2, 3, 4, 5))
+    assert torch.equal(tensors[2:, :, :3, :7], b.view(2, 3, 3, 7))
+    assert tensors[:2, :, :, 5:].abs().sum() == 0
+    assert tensors[2:, :, 3:].abs().sum() == 0
+    assert mask[:2, :, 5:].all() and mask[2:, 3:].all()
@@ -0,0 +1,43 @@
+import random
+
+from datasets.samplers import PairedBatchSampler, ShapeBucketSampler
+
+
+class FixedSizes(object):
+    """Stands in for the train transforms: the output size of a sample is its video size."""
+
+    def plan(self, image_size):
+        return None, image_size
+
+
+def bucket_sampler(num_samples, batch_size, seed):
+    rng = random.Random(seed)
+    sizes = [(rng.choice([300, 400, 500]), 300) for _ in range(num_samples)]
+    order = list(range(num_samples))
+    rng.shuffle(order)
+    return ShapeBucketSampler(order, sizes, FixedSizes(), batch_size)
+
+
+def bucket_of(sampler, item):
+    index, (_, size) = item
+    return sampler._bucket(*size)
+
+
+def test_target_batches_stay_in_one_bucket_across_passes():
+    batch_size = 4
+    source = bucket_sampler(101, batch_size, seed=0)
+    # 23 samples: the target sampler is cycled through more than four passes
+    target = bucket_sampler(23, batch_size, seed=1)
+    paired = PairedBatchSampler(source, target, batch_size)
+    batches = list(paired)
+    assert len(batches) == len(source) // batch_size
+    assert paired.target_epoch >= 4
+    for batch in batches:
+        for sampler, items in ((source, [s for s, _ in batch]), (target, [t for _, t in batch])):
+            assert len({bucket_of(sampler, item) for item in items}) == 1
+
+
+def test_every_pass_is_a_whole_number_of_batches():
+    sampler = bucket_sampler(23, 4, seed=2)
+    items = list(sampler)
+    assert len(items) == len(sampler) == 24
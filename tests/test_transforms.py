@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import datasets.transforms as T
+
+pytestmark = pytest.mark.skipif(not T._HAS_ANTIALIAS, reason='the tensor path only matches PIL with antialias')
+
+
+def clip(num_frames=2, width=720, height=405, seed=0):
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[:height, :width]
+    frames = []
+    for i in range(num_frames):
+        image = np.stack([128 + 100 * np.sin((x + i) / 3.), 128 + 100 * np.cos(y / 2.), 128 + 60 * np.sin((x + y) / 5.)], -1)
+        image += rng.uniform(-20, 20, image.shape)
+        frames.append(Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)))
+    return frames
+
+
+def assert_close_to_pil(tensor_clip, pil_clip):
+    expected = T.stack_clip(pil_clip).float()
+    diff = (tensor_clip.float() - expected).abs()
+    # same filter, only the rounding of the intermediate results differs
+    assert diff.mean() < 0.5
+    assert diff.max() <= 3
+
+
+def test_resize_matches_pil():
+    frames = clip()
+    pil, _ = T.resize(frames, None, 300, max_size=540)
+    tensor, _ = T.resize(T.stack_clip(frames), None, 300, max_size=540)
+    assert tensor.dtype == torch.uint8
+    assert_close_to_pil(tensor, pil)
+
+
+def test_resized_crop_matches_pil():
+    frames = clip()
+    box, size = (64, 32, 564, 382), (540, 378)
+    pil, _ = T.resized_crop(frames, None, box, size)
+    tensor, _ = T.resized_crop(T.stack_clip(frames), None, box, size)
+    assert_close_to_pil(tensor, pil)
@@ -14,6 +14,7 @@ from typing import Optional, List
 import torch
 import torch.distributed as dist
 from torch import Tensor
+from torch.utils.data import get_worker_info
 
 import numpy as np
 
@@ -271,7 +272,7 @@ def collate_fn(batch):
     batch[0] = nested_tensor_from_tensor_list(batch[0])
 
     # audio
-    exp = nested_tensor_from_exp(batch[1][0])
+    exp = nested_tensor_from_exp(batch[1][0]) if batch[1][0] is not None else None
 
     # exp_list = [] 
     # for e in batch[1]:
@@ -289,6 +290,55 @@ def collate_fn(batch):
     return tuple(batch)
 
 
+class CollateBuffers(object):
+    """Ring of preallocated, optionally pinned, tensors reused by collate.
+
+    Each slot keeps one flat storage per buffer name, grown to the largest batch
+    seen so far. A tensor handed out in one slot is overwritten num_slots batches
+    later, so num_slots must exceed the number of batches alive at once.
+    """
+
+    def __init__(self, num_slots=4, pin_memory=True):
+        self.num_slots = num_slots
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.slot = -1
+        self._storages = {}
+
+    def next_slot(self):
+        self.slot = (self.slot + 1) % self.num_slots
+
+    def get(self, name, shape, dtype):
+        numel = int(np.prod(shape))
+        key = (name, self.slot, dtype)
+        storage = self._storages.get(key)
+        if storage is None or storage.numel() < numel:
+            storage = torch.empty(numel, dtype=dtype, pin_memory=self.pin_memory)
+            self._storages[key] = storage
+        return storage[:numel].view(shape)
+
+
+class Collator(object):
+    """collate_fn that fills CollateBuffers when the batches are collated in the main process.
+
+    Inside loader workers the batch is moved to shared memory anyway, so fresh
+    tensors are used there and the buffers are never allocated.
+    """
+
+    def __init__(self, num_slots=4, pin_memory=True):
+        self.buffers = CollateBuffers(num_slots, pin_memory)
+
+    def __call__(self, batch):
+        out = None
+        if get_worker_info() is None:
+            out = self.buffers
+            out.next_slot()
+        batch = list(zip(*batch))
+        batch[0] = nested_tensor_from_tensor_list(batch[0], out=out)
+        # samples of sample_mode='frames' datasets carry no expressions
+        batch[1] = nested_tensor_from_exp(batch[1][0], out=out) if batch[1][0] is not None else None
+        return tuple(batch)
+
+
 def _max_by_axis(the_list):
     # type: (List[List[int]]) -> List[int]
     maxes = the_list[0]
@@ -298,66 +348,109 @@ def _max_by_axis(the_list):
     return maxes
 
 
-def nested_tensor_from_exp(exp_list):
-    max_size = _max_by_axis([list(exp.shape) for exp in exp_list])
-    batch_shape = [len(exp_list)] + max_size
-    # b, d, l = batch_shape
-    b, l, d = batch_shape
-    
-    # dtype = exp_list[0].dtype
-    # device = exp_list[0].device
-    # tensor = torch.zeros(batch_shape, dtype=dtype, device=device)
-    # mask = torch.ones((b, l), dtype=torch.bool, device=device)
-    tensor = torch.zeros(batch_shape, dtype=torch.float32)
-    # tensor = torch.zeros(batch_shape, dtype=torch.int64)
-    mask = torch.ones((b, l), dtype=torch.bool)
-    for i in range(b):
-        # tensor[i, :exp_list[i].shape[0], :exp_list[i].shape[1]].copy_(exp_list[i])
-        # mask[i, :exp_list[i].shape[1]] = False
-        tensor[i, :exp_list[i].shape[0], :exp_list[i].shape[1]].copy_(torch.from_numpy(exp_list[i]))
-        mask[i, :exp_list[i].shape[0]] = False
+def nested_tensor_from_exp(exp_list, out=None):
+    # exp_list holds [l x d] arrays, padded to [b x max(l) x d]
+    lengths = torch.as_tensor([exp.shape[0] for exp in exp_list])
+    b, l, d = len(exp_list), int(lengths.max()), exp_list[0].shape[1]
+    if out is None:
+        tensor = torch.zeros((b, l, d), dtype=torch.float32)
+        mask = torch.empty((b, l), dtype=torch.bool)
+    else:
+        tensor = out.get('exp', (b, l, d), torch.float32).zero_()
+        mask = out.get('exp_mask', (b, l), torch.bool)
+    # scatter all words at once: word k of expression i goes to tensor[i, k]
+    words = torch.from_numpy(np.concatenate(exp_list).astype(np.float32, copy=False))
+    rows = torch.arange(b).repeat_interleave(lengths)
+    cols = torch.arange(len(words)) - (torch.cumsum(lengths, 0) - lengths).repeat_interleave(lengths)
+    tensor[rows, cols] = words
+    torch.ge(torch.arange(l)[None], lengths[:, None], out=mask)
     return NestedTensor(tensor, mask)
 
 
-def nested_tensor_from_tensor_list(tensor_list: List[Tensor], split=True):
+def nested_tensor_from_tensor_list(tensor_list: List[Tensor], split=True, out=None):
     # TODO make this more general
+    if tensor_list[0].ndim != 3:
+        raise ValueError('not supported')
     if split:
-        tensor_list = [tensor.split(3,dim=0) for tensor in tensor_list]
-        tensor_list = [item for sublist in tensor_list for item in sublist]
-    if tensor_list[0].ndim == 3:
-        # TODO make it support different-sized images
-        max_size = _max_by_axis([list(img.shape) for img in tensor_list])
-        # min_size = tuple(min(s) for s in zip(*[img.shape for img in tensor_list]))
-        batch_shape = [len(tensor_list)] + max_size
-        b, c, h, w = batch_shape
-        dtype = tensor_list[0].dtype
-        device = tensor_list[0].device
-        tensor = torch.zeros(batch_shape, dtype=dtype, device=device)
-        mask = torch.ones((b, h, w), dtype=torch.bool, device=device)
-        for img, pad_img, m in zip(tensor_list, tensor, mask):
-            pad_img[: img.shape[0], : img.shape[1], : img.shape[2]].copy_(img)
-            m[: img.shape[1], :img.shape[2]] = False
+        # a [3T x H x W] clip is viewed as its T frames of [3 x H x W]
+        tensor_list = [tensor.reshape(-1, 3, *tensor.shape[-2:]) for tensor in tensor_list]
     else:
-        raise ValueError('not supported')
+        tensor_list = [tensor[None] for tensor in tensor_list]
+    num_frames = torch.as_tensor([clip.shape[0] for clip in tensor_list])
+    # with split=False the channels differ, e.g. the number of instance masks of each target
+    c = max(clip.shape[1] for clip in tensor_list)
+    h = max(clip.shape[2] for clip in tensor_list)
+    w = max(clip.shape[3] for clip in tensor_list)
+    batch_shape = (int(num_frames.sum()), c, h, w)
+    dtype = tensor_list[0].dtype
+    device = tensor_list[0].device
+    if out is None:
+        tensor = torch.empty(batch_shape, dtype=dtype, device=device)
+        mask = torch.empty((batch_shape[0], h, w), dtype=torch.bool, device=device)
+    else:
+        tensor = out.get('images', batch_shape, dtype)
+        mask = out.get('mask', (batch_shape[0], h, w), torch.bool)
+    start = 0
+    for clip in tensor_list:
+        # one strided copy per clip, only the padding is zeroed
+        n, clip_c, clip_h, clip_w = clip.shape
+        pad_clip = tensor[start:start + n]
+        pad_clip[:, :clip_c, :clip_h, :clip_w].copy_(clip)
+        pad_clip[:, clip_c:].zero_()
+        pad_clip[:, :clip_c, clip_h:].zero_()
+        pad_clip[:, :clip_c, :clip_h, clip_w:].zero_()
+        start += n
+    heights = torch.as_tensor([clip.shape[2] for clip in tensor_list]).repeat_interleave(num_frames)
+    widths = torch.as_tensor([clip.shape[3] for clip in tensor_list]).repeat_interleave(num_frames)
+    heights, widths = heights.to(mask.device), widths.to(mask.device)
+    torch.logical_or(torch.arange(h, device=mask.device)[None, :, None] >= heights[:, None, None],
+                     torch.arange(w, device=mask.device)[None, None, :] >= widths[:, None, None], out=mask)
     return NestedTensor(tensor, mask)
 
 
+def normalize_nested_tensor(samples, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+    """Converts a padded uint8 image batch to normalized float32, on its device.
+
+    The padding is set back to zero, as in the batches of float32 clips normalized by the loader.
+    """
+    tensors, mask = samples.decompose()
+    mean = torch.as_tensor(mean, device=tensors.device).view(1, -1, 1, 1)
+    std = torch.as_tensor(std, device=tensors.device).view(1, -1, 1, 1)
+    tensors = (tensors.float().div_(255) - mean).div_(std)
+    if mask is not None:
+        tensors = tensors.masked_fill_(mask[:, None], 0)
+    return NestedTensor(tensors, mask)
+
+
+def padding_efficiency(samples):
+    """Fraction of the pixels of a padded image batch that are not padding."""
+    return 1 - samples.mask.float().mean()
+
+
 class NestedTensor(object):
     def __init__(self, tensors, mask: Optional[Tensor]):
         self.tensors = tensors
         self.mask = mask
 
-    def to(self, device):
-        # type: (Device) -> NestedTensor # noqa
-        cast_tensor = self.tensors.to(device)
+    def to(self, device, non_blocking=False):
+        # type: (Device, bool) -> NestedTensor # noqa
+        cast_tensor = self.tensors.to(device, non_blocking=non_blocking)
         mask = self.mask
         if mask is not None:
             assert mask is not None
-            cast_mask = mask.to(device)
+            cast_mask = mask.to(device, non_blocking=non_blocking)
         else:
             cast_mask = None
         return NestedTensor(cast_tensor, cast_mask)
 
+    def pin_memory(self):
+        # called by DataLoader(pin_memory=True) and the prefetcher
+        mask = self.mask.pin_memory() if self.mask is not None else None
+        return NestedTensor(self.tensors.pin_memory(), mask)
+
+    def is_pinned(self):
+        return self.tensors.is_pinned() and (self.mask is None or self.mask.is_pinned())
+
     def decompose(self):
         return self.tensors, self.mask
 